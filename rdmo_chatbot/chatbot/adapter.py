@@ -1,12 +1,43 @@
-import json
+import asyncio
+import importlib
+import logging
+import time
+from functools import cached_property
 
 import chainlit as cl
-from langchain_core.messages import AIMessage, AIMessageChunk, HumanMessage
-from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
-from utils import get_config, get_store, messages_to_dicts
+from context import build_context, count_tokens
+from history import format_messages, get_window_start
+from instrumentation import (
+    context_seconds,
+    copilot_seconds,
+    first_token_seconds,
+    generation_seconds,
+    input_tokens,
+    measure,
+    output_tokens,
+)
+from langchain_core.messages import AIMessage, AIMessageChunk, HumanMessage, SystemMessage
+from responses import (
+    get_cache_key,
+    get_cache_scope,
+    get_history_key,
+    hits_total,
+    iter_chunks,
+    misses_total,
+    semantic_hits_total,
+    semantic_misses_total,
+)
+from streaming import StreamBuffer
+from utils import get_config, get_response_cache, get_semantic_cache, get_store, messages_to_dicts
+
+logger = logging.getLogger(__name__)
 
 config = get_config()
-store = get_store(config)
+
+SUMMARY_PROMPT = """
+Summarize the following conversation between a user and an assistant concisely.
+Keep all facts, decisions and open questions. If a previous summary is given, extend it.
+"""
 
 
 class BaseAdapter:
@@ -15,7 +46,8 @@ class BaseAdapter:
         if cl.context.session.client_type != "copilot":
             return default
 
-        result = await cl.CopilotFunction(name=name, args=kwargs).acall()
+        with measure(copilot_seconds, f"copilot.{name}", function=name):
+            result = await cl.CopilotFunction(name=name, args=kwargs).acall()
 
         return default if result is None else result
 
@@ -39,8 +71,20 @@ class BaseAdapter:
 
 
 class LangChainAdapter(BaseAdapter):
+    # the store, the caches, the llm and the modules they need are created when they are first used,
+    # so that the chatbot starts quickly
+
     def __init__(self, *args):
-        self.prompt = ChatPromptTemplate.from_messages(
+        self.summary_tasks = {}
+
+    @property
+    def llm(self):
+        raise NotImplementedError
+
+    @cached_property
+    def prompt(self):
+        from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+        return ChatPromptTemplate.from_messages(
             [
                 ("system", "{system_prompt}"),
                 ("system", "{context}"),
@@ -49,13 +93,50 @@ class LangChainAdapter(BaseAdapter):
             ]
         )
 
-        self.chain = self.prompt | self.llm
+    @cached_property
+    def chain(self):
+        return self.prompt | self.llm
 
-    @property
-    def llm(self):
-        raise NotImplementedError
+    @cached_property
+    def summary_prompt(self):
+        from langchain_core.prompts import ChatPromptTemplate
+        return ChatPromptTemplate.from_messages(
+            [
+                ("system", "{summary_prompt}"),
+                ("user", "{content}")
+            ]
+        )
+
+    @cached_property
+    def summary_chain(self):
+        return self.summary_prompt | self.llm
+
+    @cached_property
+    def store(self):
+        return get_store(config)
+
+    @cached_property
+    def response_cache(self):
+        return get_response_cache(config)
+
+    @cached_property
+    def semantic_cache(self):
+        return get_semantic_cache(config)
+
+    @cached_property
+    def admission(self):
+        from admission import get_admission
+        return get_admission()
+
+    @cached_property
+    def sweeper(self):
+        from retention import get_sweeper
+        return get_sweeper(self.store)
 
     async def on_chat_start(self):
+        if self.sweeper is not None:
+            self.sweeper.start()
+
         # get the user from the session
         user = cl.user_session.get("user")
 
@@ -68,14 +149,15 @@ class LangChainAdapter(BaseAdapter):
         cl.user_session.set("lang_code", lang_code)
 
         # check if we have a history, yet
-        if store.has_history(user.identifier, project_id):
+        history = await self.get_history(user, project_id)
+        if history:
             await self.send_continuation(lang_code)
-            await self.send_history(user, project_id)
+            await self.send_history(user, history)
         else:
             # if the history is empty, display the confirmation message
             if await self.send_confirmation(lang_code):
                 content = getattr(config, f"START_{lang_code.upper()}", "").strip()
-                store.set_history(user.identifier, project_id, [
+                await self.set_history(user, project_id, [
                     AIMessage(content=content)
                 ])
                 await cl.Message(content=content).send()
@@ -83,59 +165,142 @@ class LangChainAdapter(BaseAdapter):
                 await self.call_copilot("toggleCopilot")
 
     async def on_user_message(self, message):
+        from admission import QueueFull, QueueTimeout
+        from router import BackendUnavailable
+
         # get the user from the session
         user = cl.user_session.get("user")
 
         # get the full project from the copilot
-        project = await self.call_copilot("getProject")
-        project = project if isinstance(project, dict) else {}
+        project = await self.get_project()
         project_id = project.get("id")
 
-        # get the history from the store
-        history = store.get_history(user.identifier, project_id)
+        # get the history from the session or the store
+        history = await self.get_history(user, project_id)
 
         # collect inputs for the llm
         inputs = {
             "system_prompt": config.SYSTEM_PROMPT.format(user=user.display_name),
-            "context": json.dumps(project),
-            "history": history,
+            "context": await self.get_context(project, message.content),
+            "history": await self.get_history_window(user, project_id, history),
             "content": message.content
         }
 
         # send an initial empty response
         response_message = await cl.Message(content="").send()
 
-        # stream from or invoke the chain
-        if config.STREAM:
-            async for chunk in self.chain.astream(inputs):
-                if isinstance(chunk, AIMessageChunk):
-                    await response_message.stream_token(chunk.content)
+        # look up the response in the caches, a cached response is sent like a response of the llm
+        lookup = await self.lookup_response(project, inputs)
+        cached_response = lookup.get("response")
+
+        if cached_response is not None:
+            if config.STREAM:
+                async with StreamBuffer(response_message) as stream_buffer:
+                    for token in iter_chunks(cached_response):
+                        await stream_buffer.write(token)
+            else:
+                response_message.content = cached_response
+
         else:
-            response = await self.chain.ainvoke(inputs)
-            response_message.content = response.content
+            try:
+                await self.generate(user, response_message, inputs)
+            except (QueueFull, QueueTimeout, BackendUnavailable):
+                await self.send_busy(response_message)
+                return response_message
+
+        if cached_response is None and response_message.content:
+            await self.cache_response(project_id, lookup, response_message.content)
 
         # add the transfer action
         response_message.actions = [
             cl.Action(name="on_transfer", icon="file-output", payload={
                 "content": response_message.content
             }),
+            # only a reference is sent, the history is loaded when the action is used
             cl.Action(name="on_contact", icon="mail", payload={
-                "history": messages_to_dicts(history)
+                "project_id": project_id
             })
         ]
 
         # update the message
         await response_message.update()
 
-        # add messages to history and store
-        store.set_history(user.identifier, project_id, [
-            *history,
+        # add the new messages to the history in the session and the store
+        await self.append_history(user, project_id, [
             HumanMessage(content=message.content),
             AIMessage(content=response_message.content)
         ])
 
         return response_message
 
+    async def generate(self, user, response_message, inputs):
+        # the number of concurrent requests to the llm is limited, while waiting, the position in the queue is shown
+        queue_message = None
+
+        async def on_position(position):
+            nonlocal queue_message
+            lang_code = cl.user_session.get("lang_code") or "en"
+            content = getattr(config, f"QUEUE_{lang_code.upper()}", "").strip().format(position=position)
+            if queue_message is None:
+                queue_message = await cl.Message(content=content).send()
+            else:
+                queue_message.content = content
+                await queue_message.update()
+
+        try:
+            async with self.admission.limit(user.identifier, on_position):
+                if queue_message is not None:
+                    await queue_message.remove()
+                    queue_message = None
+
+                await self.run_chain(self.chain, response_message, inputs)
+        finally:
+            if queue_message is not None:
+                await queue_message.remove()
+
+    async def run_chain(self, chain, response_message, inputs, on_first_token=None):
+        started = time.monotonic()
+        usage = None
+
+        # stream from or invoke the chain, the streamed tokens are coalesced before they are sent
+        with measure(generation_seconds, "llm.generate"):
+            if config.STREAM:
+                first_token = True
+                async with StreamBuffer(response_message) as stream_buffer:
+                    async for chunk in chain.astream(inputs):
+                        if isinstance(chunk, AIMessageChunk):
+                            if first_token:
+                                first_token = False
+                                first_token_seconds.observe(time.monotonic() - started)
+                                if on_first_token is not None:
+                                    on_first_token()
+                            usage = chunk.usage_metadata or usage
+                            await stream_buffer.write(chunk.content)
+            else:
+                response = await chain.ainvoke(inputs)
+                # without streaming, the whole response is the first token
+                if on_first_token is not None:
+                    on_first_token()
+                response_message.content = response.content
+                usage = getattr(response, "usage_metadata", None)
+
+        self.record_tokens(inputs, response_message.content, usage)
+
+    def record_tokens(self, inputs, content, usage):
+        # the usage is reported by most models, otherwise the tokens are estimated
+        if usage:
+            input_tokens.inc(usage.get("input_tokens", 0))
+            output_tokens.inc(usage.get("output_tokens", 0))
+        else:
+            input_tokens.inc(sum(count_tokens(str(message.content)) for message in inputs["history"]) +
+                             count_tokens(inputs["system_prompt"] + inputs["context"] + inputs["content"]))
+            output_tokens.inc(count_tokens(content))
+
+    async def send_busy(self, response_message):
+        lang_code = cl.user_session.get("lang_code") or "en"
+        response_message.content = getattr(config, f"BUSY_{lang_code.upper()}", "").strip()
+        await response_message.update()
+
     async def on_system_message(self, message):
         try:
             action = message.metadata.get("action")
@@ -145,28 +310,170 @@ class LangChainAdapter(BaseAdapter):
         if action == "reset_history":
             user = cl.user_session.get("user")
             project_id = cl.user_session.get("project_id")
-            store.reset_history(user.identifier, project_id)
+            await self.store.reset_history(user.identifier, project_id)
+            cl.user_session.set(f"history:{project_id}", None)
 
     async def on_transfer(self, action):
         await self.call_copilot("handleTransfer", **action.payload)
 
     async def on_contact(self, action):
-        # get user and project_id from the session
+        # get user from the session and project_id from the action (or the session)
         user = cl.user_session.get("user")
-        project_id = cl.user_session.get("project_id")
+        project_id = (action.payload or {}).get("project_id", cl.user_session.get("project_id"))
 
-        # get the history from the store
-        history = store.get_history(user.identifier, project_id)
+        # get the history from the session or the store
+        history = await self.get_history(user, project_id)
 
         await self.call_copilot("openContactModal", history=messages_to_dicts(history))
 
+    async def get_history(self, user, project_id):
+        # the history is loaded once per session and then kept up to date by set_history and append_history,
+        # messages which are added in another tab are only seen after the chat was started again
+        history = cl.user_session.get(f"history:{project_id}")
+        if history is None:
+            history = await self.store.get_history(user.identifier, project_id)
+            cl.user_session.set(f"history:{project_id}", history)
+
+        return history
+
+    async def set_history(self, user, project_id, history):
+        cl.user_session.set(f"history:{project_id}", list(history))
+        await self.store.set_history(user.identifier, project_id, history)
+
+    async def append_history(self, user, project_id, messages):
+        history = cl.user_session.get(f"history:{project_id}")
+        if history is not None:
+            history.extend(messages)
+        await self.store.append_messages(user.identifier, project_id, messages)
+
+    async def get_project(self):
+        # the last project is kept in the session, along with its etag, so that
+        # the copilot only needs to send the project again if it has changed
+        etag = cl.user_session.get("project_etag")
+        result = await self.call_copilot("getProject", etag=etag)
+
+        if not isinstance(result, dict):
+            return {}
+
+        if result.get("modified") is False:
+            project = cl.user_session.get("project")
+            if project is not None:
+                return project
+
+            # the session lost the project, fetch it again without the etag
+            result = await self.call_copilot("getProject")
+            if not isinstance(result, dict):
+                return {}
+
+        project = result.get("project", {}) if "modified" in result else result
+        project = project if isinstance(project, dict) else {}
+
+        # the answers of the project have changed, the cached responses are removed
+        if etag is not None and result.get("etag") != etag:
+            if self.response_cache is not None:
+                await self.response_cache.invalidate(project.get("id"))
+            if self.semantic_cache is not None:
+                self.semantic_cache.invalidate(project.get("id"))
+
+        cl.user_session.set("project", project)
+        cl.user_session.set("project_etag", result.get("etag"))
+
+        return project
+
+    async def lookup_response(self, project, inputs):
+        lookup = {}
+        history_length = getattr(config, "RESPONSE_CACHE_HISTORY", 2)
+        scope = get_cache_scope(config.SYSTEM_PROMPT, cl.user_session.get("user").identifier)
+
+        if self.response_cache is not None:
+            lookup["key"] = get_cache_key(config.SYSTEM_PROMPT, inputs, history_length, scope)
+            lookup["response"] = await self.response_cache.get(project.get("id"), lookup["key"])
+            (hits_total if lookup["response"] is not None else misses_total).inc()
+            if lookup["response"] is not None:
+                return lookup
+
+        # if there is no exact match, look for the response to a similar question
+        if self.semantic_cache is not None:
+            try:
+                lookup["vector"] = await self.semantic_cache.embed(inputs["content"])
+            except Exception:
+                logger.exception("Could not embed the question for the semantic cache")
+                return lookup
+
+            lookup["partition_key"] = self.semantic_cache.get_partition_key(
+                project, cl.user_session.get("project_etag"), cl.user_session.get("lang_code")
+            )
+            lookup["history"] = get_history_key(inputs["history"], history_length, scope)
+            lookup["response"] = self.semantic_cache.get(lookup["partition_key"], lookup["vector"], lookup["history"])
+            (semantic_hits_total if lookup["response"] is not None else semantic_misses_total).inc()
+
+        return lookup
+
+    async def cache_response(self, project_id, lookup, response):
+        if "key" in lookup:
+            await self.response_cache.set(project_id, lookup["key"], response)
+        if "vector" in lookup:
+            self.semantic_cache.set(lookup["partition_key"], lookup["vector"], lookup["history"], response)
+
+    async def get_context(self, project, content):
+        with measure(context_seconds, "context.build"):
+            # only send the answers which are relevant for the current message
+            top_k = getattr(config, "CONTEXT_TOP_K", None)
+            if top_k:
+                from retrieval import search_answers
+                project = {**project, "answers": await search_answers(project, content, top_k)}
+
+            return build_context(project)
+
+    async def get_history_window(self, user, project_id, history):
+        start = get_window_start(history)
+        if start == 0:
+            return history
+
+        window = history[start:]
+
+        # the older messages are replaced by a summary, which is updated in the background
+        if getattr(config, "HISTORY_SUMMARY", False):
+            summary, count = await self.store.get_summary(user.identifier, project_id) or ("", 0)
+            if count < start:
+                self.start_summary(user.identifier, project_id, summary, history[count:start], start)
+            if summary:
+                window = [SystemMessage(content=f"Summary of the earlier conversation:\n{summary}"), *window]
+
+        return window
+
+    def start_summary(self, user_identifier, project_id, summary, messages, count):
+        key = (user_identifier, project_id)
+        if key not in self.summary_tasks:
+            task = asyncio.create_task(self.update_summary(user_identifier, project_id, summary, messages, count))
+            task.add_done_callback(lambda task: self.summary_tasks.pop(key, None))
+            self.summary_tasks[key] = task
+
+    async def update_summary(self, user_identifier, project_id, summary, messages, count):
+        content = format_messages(messages)
+        if summary:
+            content = f"Previous summary:\n{summary}\n\nConversation:\n{content}"
+
+        try:
+            response = await self.summary_chain.ainvoke({
+                "summary_prompt": getattr(config, "HISTORY_SUMMARY_PROMPT", SUMMARY_PROMPT),
+                "content": content
+            })
+        except Exception:
+            logger.exception("Could not update the summary for %s/%s", user_identifier, project_id)
+            return
+
+        # the history might have been reset in the meantime
+        if await self.store.has_history(user_identifier, project_id):
+            await self.store.set_summary(user_identifier, project_id, response.content, count)
+
     async def send_continuation(self, lang_code):
         content = getattr(config, f"CONTINUATION_{lang_code.upper()}", "")
         await cl.Message(content=content).send()
 
-    async def send_history(self, user, project_id):
-        history = store.get_history(user.identifier, project_id)
-
+    async def send_history(self, user, history):
+        # the messages are sent one after another, so that they are shown in order, chainlit has no event
+        # which renders several messages at once (resume_thread replaces all messages of the copilot)
         for message in history:
             if isinstance(message, HumanMessage):
                 message_author = user.display_name or "You"
@@ -190,17 +497,115 @@ class LangChainAdapter(BaseAdapter):
 
         return response and response.get("payload").get("value") == "confirmation"
 
+
 class OpenAILangChainAdapter(LangChainAdapter):
 
-    @property
+    @cached_property
     def llm(self):
+        return self.create_llm(config.LLM_ARGS)
+
+    @classmethod
+    def create_llm(cls, llm_args):
+        from clients import get_client_options, get_http_client
         from langchain_openai import ChatOpenAI
-        return ChatOpenAI(**config.LLM_ARGS)
+        options = get_client_options()
+        return ChatOpenAI(**{
+            "http_async_client": get_http_client(),
+            "timeout": options["timeout"],
+            "max_retries": options["retries"],  # the openai client retries with exponential backoff
+            **llm_args
+        })
 
 
 class OllamaLangChainAdapter(LangChainAdapter):
 
-    @property
+    @cached_property
     def llm(self):
+        return self.create_llm(config.LLM_ARGS)
+
+    @classmethod
+    def create_llm(cls, llm_args):
+        from clients import get_client_options, get_http_transport
         from langchain_ollama import ChatOllama
-        return ChatOllama(**config.LLM_ARGS)
+        options = get_client_options()
+        llm_args = dict(llm_args)
+        llm_args["async_client_kwargs"] = {
+            "transport": get_http_transport(),
+            "timeout": options["timeout"],
+            **llm_args.get("async_client_kwargs", {})
+        }
+        return ChatOllama(**llm_args)
+
+
+class RouterLangChainAdapter(LangChainAdapter):
+
+    @cached_property
+    def router(self):
+        return self.create_router(getattr(config, "ROUTER", {}))
+
+    @cached_property
+    def chains(self):
+        return {backend.name: self.prompt | backend.llm for backend in self.router.backends}
+
+    @cached_property
+    def llm(self):
+        # the summaries are not balanced, they fall back to the other backends in order
+        first, *others = [backend.llm for backend in self.router.backends]
+        return first.with_fallbacks(others) if others else first
+
+    @classmethod
+    def create_router(cls, options):
+        from router import Backend, Router
+
+        backends = []
+        for index, backend in enumerate(options.get("backends", [])):
+            adapter_module_name, adapter_class_name = backend["adapter"].rsplit(".", 1)
+            adapter_module = importlib.import_module(adapter_module_name)
+            adapter_class = getattr(adapter_module, adapter_class_name)
+            backends.append(Backend(
+                name=backend.get("name", f"backend-{index}"),
+                llm=adapter_class.create_llm(backend.get("llm_args", {})),
+                health_url=backend.get("health_url")
+            ))
+
+        if not backends:
+            raise RuntimeError("The RouterLangChainAdapter needs at least one backend in CHATBOT_ROUTER.")
+
+        return Router(backends, **{
+            key: options[key] for key in ["strategy", "failure_threshold", "cooldown", "probe_interval"]
+            if key in options
+        })
+
+    async def run_chain(self, chain, response_message, inputs, on_first_token=None):
+        from router import BackendUnavailable
+
+        # the request is sent to another backend if it fails before the first token was received
+        tried = []
+        while True:
+            backend = self.router.select(exclude=tried)
+            if backend is None:
+                raise BackendUnavailable
+
+            tried.append(backend)
+            try:
+                async with self.router.request(backend) as request:
+                    return await super().run_chain(self.chains[backend.name], response_message, inputs,
+                                                   on_first_token=request.first_token)
+            except Exception:
+                if request.latency is not None:
+                    raise
+                logger.warning("Backend %s failed, the request is sent to the next backend.", backend.name,
+                               exc_info=True)
+
+
+class FakeLangChainAdapter(LangChainAdapter):
+    # answers using a fake model with a configurable latency and token rate, e.g. for benchmarks
+
+    @cached_property
+    def llm(self):
+        return self.create_llm(getattr(config, "LLM_ARGS", {}))
+
+    @classmethod
+    def create_llm(cls, llm_args):
+        from fake import FakeChatModel
+        return FakeChatModel(**llm_args)
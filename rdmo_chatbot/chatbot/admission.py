@@ -0,0 +1,145 @@
+import asyncio
+import time
+from collections import Counter, deque
+from contextlib import asynccontextmanager
+
+from metrics import counter, gauge
+from utils import get_config
+
+config = get_config()
+
+queue_depth = gauge("chatbot_queue_depth", "Requests to the LLM which are waiting in the queue.")
+queue_running = gauge("chatbot_queue_running", "Requests to the LLM which are currently admitted.")
+queue_wait_seconds = counter("chatbot_queue_wait_seconds_total", "Time spent by the requests waiting in the queue.")
+queue_admitted = counter("chatbot_queue_admitted_total", "Requests to the LLM which were admitted.")
+queue_rejected = counter("chatbot_queue_rejected_total", "Requests which were rejected, because the queue was full.")
+queue_timeouts = counter("chatbot_queue_timeouts_total", "Requests which waited longer than the queue timeout.")
+
+
+class QueueFull(Exception):
+    pass
+
+
+class QueueTimeout(Exception):
+    pass
+
+
+class Waiter:
+
+    def __init__(self, user_identifier):
+        loop = asyncio.get_running_loop()
+        self.user_identifier = user_identifier
+        self.admitted = loop.create_future()
+        self.moved = loop.create_future()
+
+
+class Admission:
+    # limits the number of concurrent requests to the llm, globally and for each user, requests which can not
+    # run immediately wait in a first-in-first-out queue, but skip the requests of users who are at their limit
+
+    def __init__(self, max_requests=None, max_user_requests=None, max_queue=None, timeout=None):
+        self.max_requests = max_requests
+        self.max_user_requests = max_user_requests
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.running = 0
+        self.running_by_user = Counter()
+        self.waiters = deque()
+
+    def can_run(self, user_identifier):
+        return (not self.max_requests or self.running < self.max_requests) and \
+            (not self.max_user_requests or self.running_by_user[user_identifier] < self.max_user_requests)
+
+    def start(self, user_identifier):
+        self.running += 1
+        self.running_by_user[user_identifier] += 1
+        queue_running.set(self.running)
+        queue_admitted.inc()
+
+    def release(self, user_identifier):
+        self.running -= 1
+        self.running_by_user[user_identifier] -= 1
+        if not self.running_by_user[user_identifier]:
+            del self.running_by_user[user_identifier]
+        queue_running.set(self.running)
+        self.dispatch()
+
+    def dispatch(self):
+        # admit the waiting requests in order, as long as there are free slots
+        for waiter in list(self.waiters):
+            if self.max_requests and self.running >= self.max_requests:
+                break
+            if self.can_run(waiter.user_identifier):
+                self.waiters.remove(waiter)
+                self.start(waiter.user_identifier)
+                waiter.admitted.set_result(True)
+
+        # wake up the remaining requests, so that they can report their new position
+        for waiter in self.waiters:
+            if not waiter.moved.done():
+                waiter.moved.set_result(True)
+
+        queue_depth.set(len(self.waiters))
+
+    async def acquire(self, user_identifier, on_position=None):
+        # requests of the same user keep their order
+        if self.can_run(user_identifier) and \
+                not any(waiter.user_identifier == user_identifier for waiter in self.waiters):
+            self.start(user_identifier)
+            return
+
+        if self.max_queue and len(self.waiters) >= self.max_queue:
+            queue_rejected.inc()
+            raise QueueFull
+
+        waiter = Waiter(user_identifier)
+        self.waiters.append(waiter)
+        queue_depth.set(len(self.waiters))
+
+        started = time.monotonic()
+        position = None
+        try:
+            while not waiter.admitted.done():
+                if on_position is not None and self.waiters.index(waiter) + 1 != position:
+                    position = self.waiters.index(waiter) + 1
+                    await on_position(position)
+                    continue
+
+                timeout = None
+                if self.timeout:
+                    timeout = started + self.timeout - time.monotonic()
+                    if timeout <= 0:
+                        queue_timeouts.inc()
+                        raise QueueTimeout
+
+                waiter.moved = asyncio.get_running_loop().create_future()
+                await asyncio.wait([waiter.admitted, waiter.moved], timeout=timeout,
+                                   return_when=asyncio.FIRST_COMPLETED)
+        except BaseException:
+            # the request was cancelled or timed out, while waiting or right after it was admitted
+            if waiter.admitted.done():
+                self.release(user_identifier)
+            else:
+                self.waiters.remove(waiter)
+                self.dispatch()
+            raise
+        finally:
+            queue_wait_seconds.inc(time.monotonic() - started)
+
+    @asynccontextmanager
+    async def limit(self, user_identifier, on_position=None):
+        await self.acquire(user_identifier, on_position)
+        try:
+            yield
+        finally:
+            self.release(user_identifier)
+
+
+def get_admission():
+    options = getattr(config, "QUEUE", {})
+    return Admission(
+        max_requests=options.get("max_requests"),
+        max_user_requests=options.get("max_user_requests"),
+        max_queue=options.get("max_queue"),
+        timeout=options.get("timeout")
+    )
@@ -1,9 +1,35 @@
+import hmac
+
 import chainlit as cl
+from chainlit.server import app as server
+from metrics import render
+from starlette.responses import PlainTextResponse
+from starlette.routing import Route
 from utils import get_adapter, get_config, get_user
 
 config = get_config()
 adapter = get_adapter(config)
 
+LOCAL_HOSTS = ["127.0.0.1", "::1"]
+
+
+async def metrics(request):
+    # the metrics are only shown to clients with the token, or to local clients if no token is configured
+    token = getattr(config, "METRICS_TOKEN", None)
+    if token:
+        authorization = request.headers.get("Authorization", "")
+        if not hmac.compare_digest(authorization.encode(), f"Bearer {token}".encode()):
+            return PlainTextResponse("Unauthorized", status_code=401, headers={"WWW-Authenticate": "Bearer"})
+    elif request.client is None or request.client.host not in LOCAL_HOSTS:
+        return PlainTextResponse("Forbidden", status_code=403)
+
+    return PlainTextResponse(render(), media_type="text/plain; version=0.0.4")
+
+
+# the route is inserted before the catch-all route of the chainlit frontend
+if getattr(config, "METRICS", False):
+    server.router.routes.insert(0, Route("/metrics", metrics))
+
 
 @cl.header_auth_callback
 def header_auth_callback(headers):
@@ -0,0 +1,44 @@
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+
+class BaseCache:
+
+    # whether the methods of the cache perform blocking I/O
+    blocking = True
+
+    def get(self, project_id, key):
+        raise NotImplementedError
+
+    def set(self, project_id, key, response):
+        raise NotImplementedError
+
+    def invalidate(self, project_id):
+        raise NotImplementedError
+
+
+class AsyncCacheWrapper:
+    # wraps a cache, blocking caches are run in a thread pool, so that their I/O does not block the event loop
+
+    def __init__(self, cache):
+        self.cache = cache
+        self.executor = None
+        if getattr(cache, "blocking", True):
+            self.executor = ThreadPoolExecutor(getattr(cache, "max_workers", 1), thread_name_prefix="cache")
+
+    async def run(self, method, *args):
+        function = functools.partial(getattr(self.cache, method), *args)
+        if self.executor is None:
+            return function()
+        else:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, function)
+
+    async def get(self, project_id, key):
+        return await self.run("get", project_id, key)
+
+    async def set(self, project_id, key, response):
+        return await self.run("set", project_id, key, response)
+
+    async def invalidate(self, project_id):
+        return await self.run("invalidate", project_id)
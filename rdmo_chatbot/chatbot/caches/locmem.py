@@ -0,0 +1,43 @@
+import time
+from collections import OrderedDict
+
+from ..utils import get_config
+from . import BaseCache
+
+config = get_config()
+
+
+class LocMemCache(BaseCache):
+
+    blocking = False
+
+    def __init__(self):
+        self.max_entries = getattr(config, "RESPONSE_CACHE_MAX_ENTRIES", 1000)
+        self.ttl = getattr(config, "RESPONSE_CACHE_TTL", None)
+        self.entries = OrderedDict()  # (project_id, key) -> (expires, response)
+
+    def get(self, project_id, key):
+        entry = self.entries.get((project_id, key))
+        if entry is None:
+            return None
+
+        expires, response = entry
+        if expires is not None and expires < time.monotonic():
+            del self.entries[(project_id, key)]
+            return None
+
+        self.entries.move_to_end((project_id, key))
+        return response
+
+    def set(self, project_id, key, response):
+        expires = time.monotonic() + self.ttl if self.ttl else None
+        self.entries[(project_id, key)] = (expires, response)
+        self.entries.move_to_end((project_id, key))
+
+        # evict the least recently used entries
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def invalidate(self, project_id):
+        for entry_key in [entry_key for entry_key in self.entries if entry_key[0] == project_id]:
+            del self.entries[entry_key]
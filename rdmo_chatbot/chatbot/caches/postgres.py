@@ -0,0 +1,67 @@
+import psycopg
+
+from ..stores import ThreadLocalConnection, get_connection_kwargs
+from ..utils import get_config
+from . import BaseCache
+
+config = get_config()
+
+
+class PostgresCache(BaseCache):
+
+    def __init__(self):
+        connection = getattr(config, "RESPONSE_CACHE_CONNECTION", config.STORE_CONNECTION)
+        self.connection_kwargs, self.max_workers = get_connection_kwargs(connection)
+        self.ttl = getattr(config, "RESPONSE_CACHE_TTL", None)
+        self.connection = ThreadLocalConnection(self.connect, check=self.check)
+        self.create_table()
+
+    def connect(self):
+        return psycopg.connect(**self.connection_kwargs)
+
+    def check(self, connection):
+        if connection.closed or connection.broken:
+            raise psycopg.OperationalError("the connection was lost")
+
+    def get_cursor(self):
+        return self.connection.get().cursor()
+
+    def create_table(self):
+        cursor = self.get_cursor()
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS response_cache (
+                id INT GENERATED ALWAYS AS IDENTITY PRIMARY KEY,
+                project_id INT,
+                cache_key VARCHAR(64),
+                response TEXT,
+                expires TIMESTAMP,
+                UNIQUE (project_id, cache_key)
+            );
+        """)
+        cursor.connection.commit()
+
+    def get(self, project_id, key):
+        cursor = self.get_cursor()
+        cursor.execute("""
+            SELECT response FROM response_cache
+            WHERE project_id = %s AND cache_key = %s AND (expires IS NULL OR expires > CURRENT_TIMESTAMP);
+        """, (project_id, key))
+        result = cursor.fetchone()
+        cursor.connection.commit()
+        return result[0] if result else None
+
+    def set(self, project_id, key, response):
+        cursor = self.get_cursor()
+        cursor.execute("""
+            INSERT INTO response_cache (project_id, cache_key, response, expires)
+            VALUES (%s, %s, %s, CURRENT_TIMESTAMP + make_interval(secs => %s))
+            ON CONFLICT (project_id, cache_key) DO UPDATE SET response = EXCLUDED.response, expires = EXCLUDED.expires;
+        """, (project_id, key, response, self.ttl))
+        cursor.connection.commit()
+
+    def invalidate(self, project_id):
+        cursor = self.get_cursor()
+        cursor.execute("""
+            DELETE FROM response_cache WHERE project_id = %s;
+        """, (project_id, ))
+        cursor.connection.commit()
@@ -0,0 +1,36 @@
+import redis
+
+from ..stores import get_connection_kwargs
+from ..utils import get_config
+from . import BaseCache
+
+config = get_config()
+
+
+class RedisCache(BaseCache):
+
+    def __init__(self):
+        connection = getattr(config, "RESPONSE_CACHE_CONNECTION", config.STORE_CONNECTION)
+        connection_kwargs, self.max_workers = get_connection_kwargs(connection)
+        self.redis_client = redis.Redis(max_connections=self.max_workers, **connection_kwargs)
+        self.ttl = getattr(config, "RESPONSE_CACHE_TTL", None)
+
+    def get(self, project_id, key):
+        response = self.redis_client.get(f"response:{project_id}:{key}")
+        return response.decode() if response else None
+
+    def set(self, project_id, key, response):
+        # the keys of a project are collected in a set, so that they can be removed at once
+        pipeline = self.redis_client.pipeline()
+        pipeline.set(f"response:{project_id}:{key}", response, ex=self.ttl)
+        pipeline.sadd(f"responses:{project_id}", key)
+        if self.ttl:
+            pipeline.expire(f"responses:{project_id}", self.ttl)
+        pipeline.execute()
+
+    def invalidate(self, project_id):
+        keys = self.redis_client.smembers(f"responses:{project_id}")
+        self.redis_client.delete(
+            f"responses:{project_id}",
+            *[f"response:{project_id}:{key.decode()}" for key in keys]
+        )
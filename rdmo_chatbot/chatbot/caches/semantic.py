@@ -0,0 +1,149 @@
+import importlib
+import math
+import time
+from bisect import bisect_right
+
+from ..utils import get_config
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+config = get_config()
+
+
+def normalize(vector):
+    norm = math.sqrt(sum(value * value for value in vector)) or 1
+    return [value / norm for value in vector]
+
+
+class SemanticPartition:
+    # the normalized embeddings of the cached questions, ordered by the time they were added,
+    # with numpy the embeddings are kept in one matrix, which grows by doubling its capacity
+
+    def __init__(self):
+        self.matrix = None
+        self.vectors = []
+        self.times = []
+        self.histories = []
+        self.responses = []
+
+    def __len__(self):
+        return len(self.times)
+
+    def add(self, vector, history, response, now):
+        if np is not None:
+            if self.matrix is None:
+                self.matrix = np.empty((16, len(vector)), dtype=np.float32)
+            elif len(self) == len(self.matrix):
+                self.matrix = np.concatenate([self.matrix, np.empty_like(self.matrix)])
+            self.matrix[len(self)] = vector
+        else:
+            self.vectors.append(vector)
+
+        self.times.append(now)
+        self.histories.append(history)
+        self.responses.append(response)
+
+    def evict(self, count):
+        # removes the oldest entries
+        if count <= 0:
+            return
+
+        if np is not None:
+            self.matrix[:len(self) - count] = self.matrix[count:len(self)]
+        else:
+            del self.vectors[:count]
+
+        del self.times[:count]
+        del self.histories[:count]
+        del self.responses[:count]
+
+    def expire(self, before):
+        self.evict(bisect_right(self.times, before))
+
+    def search(self, vector, history, threshold):
+        # returns the response of the most similar question above the threshold, which was asked after the same messages
+        if not self.times:
+            return None
+
+        if np is not None:
+            similarities = self.matrix[:len(self)] @ np.asarray(vector, dtype=np.float32)
+            candidates = np.flatnonzero(similarities >= threshold)
+            candidates = candidates[np.argsort(-similarities[candidates])].tolist()
+        else:
+            similarities = [sum(a * b for a, b in zip(row, vector)) for row in self.vectors]
+            candidates = sorted((index for index, similarity in enumerate(similarities) if similarity >= threshold),
+                                key=similarities.__getitem__, reverse=True)
+
+        for index in candidates:
+            if self.histories[index] == history:
+                return self.responses[index]
+
+
+class SemanticCache:
+    # an in-process cache, which returns the response of a similar question after the same messages,
+    # the questions are separated by project, version of its answers and language
+
+    def __init__(self):
+        self.embeddings = self.get_embeddings()
+        self.threshold = getattr(config, "RESPONSE_CACHE_SEMANTIC_THRESHOLD", 0.95)
+        self.max_entries = getattr(config, "RESPONSE_CACHE_SEMANTIC_MAX_ENTRIES", 1000)
+        self.ttl = getattr(config, "RESPONSE_CACHE_TTL", None)
+        self.partitions = {}
+
+    def get_embeddings(self):
+        # by default, the embedding model of the context is used
+        if hasattr(config, "RESPONSE_CACHE_EMBEDDINGS"):
+            embeddings = config.RESPONSE_CACHE_EMBEDDINGS
+            embeddings_args = getattr(config, "RESPONSE_CACHE_EMBEDDINGS_ARGS", {})
+        else:
+            embeddings = getattr(config, "CONTEXT_EMBEDDINGS", None)
+            embeddings_args = getattr(config, "CONTEXT_EMBEDDINGS_ARGS", {})
+
+        if not embeddings:
+            raise RuntimeError("The semantic cache needs CHATBOT_RESPONSE_CACHE_EMBEDDINGS to be set.")
+
+        embeddings_module_name, embeddings_class_name = embeddings.rsplit(".", 1)
+        embeddings_module = importlib.import_module(embeddings_module_name)
+        embeddings_class = getattr(embeddings_module, embeddings_class_name)
+        return embeddings_class(**embeddings_args)
+
+    def get_partition_key(self, project, version, lang_code):
+        return (project.get("id"), version, lang_code)
+
+    def get_partition(self, partition_key):
+        partition = self.partitions.get(partition_key)
+        if partition is not None and self.ttl:
+            partition.expire(time.monotonic() - self.ttl)
+        return partition
+
+    async def embed(self, question):
+        return normalize(await self.embeddings.aembed_query(question))
+
+    def get(self, partition_key, vector, history):
+        partition = self.get_partition(partition_key)
+        if partition is None:
+            return None
+
+        return partition.search(vector, history, self.threshold)
+
+    def set(self, partition_key, vector, history, response):
+        partition = self.get_partition(partition_key)
+        if partition is None:
+            # the partitions of older versions of the answers are not used anymore
+            for key in [key for key in self.partitions if key[::2] == partition_key[::2]]:
+                del self.partitions[key]
+
+            partition = self.partitions[partition_key] = SemanticPartition()
+
+        partition.add(vector, history, response, time.monotonic())
+
+        # evict the oldest tenth of the entries at once, so that the matrix is not moved for every entry
+        if len(partition) > self.max_entries:
+            partition.evict(len(partition) - self.max_entries + self.max_entries // 10)
+
+    def invalidate(self, project_id):
+        for partition_key in [key for key in self.partitions if key[0] == project_id]:
+            del self.partitions[partition_key]
@@ -0,0 +1,68 @@
+import sqlite3
+
+from ..stores import ThreadLocalConnection, get_connection_kwargs
+from ..utils import get_config
+from . import BaseCache
+
+config = get_config()
+
+
+class Sqlite3Cache(BaseCache):
+
+    def __init__(self):
+        connection = getattr(config, "RESPONSE_CACHE_CONNECTION", config.STORE_CONNECTION)
+        if isinstance(connection, dict):
+            self.connection_kwargs, self.max_workers = get_connection_kwargs(connection)
+        else:
+            self.connection_kwargs, self.max_workers = {"database": connection}, 4
+
+        self.ttl = getattr(config, "RESPONSE_CACHE_TTL", None)
+        self.connection = ThreadLocalConnection(self.connect)
+        self.create_table()
+
+    def connect(self):
+        connection = sqlite3.connect(**self.connection_kwargs)
+        connection.execute("PRAGMA journal_mode=WAL;")
+        return connection
+
+    def get_cursor(self):
+        return self.connection.get().cursor()
+
+    def create_table(self):
+        cursor = self.get_cursor()
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS response_cache (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                project_id INTEGER,
+                cache_key TEXT,
+                response TEXT,
+                expires TIMESTAMP,
+                UNIQUE(project_id, cache_key)
+            );
+        """)
+        cursor.connection.commit()
+
+    def get(self, project_id, key):
+        cursor = self.get_cursor()
+        cursor.execute("""
+            SELECT response FROM response_cache
+            WHERE project_id = ? AND cache_key = ? AND (expires IS NULL OR expires > CURRENT_TIMESTAMP);
+        """, (project_id, key))
+        result = cursor.fetchone()
+        return result[0] if result else None
+
+    def set(self, project_id, key, response):
+        cursor = self.get_cursor()
+        cursor.execute("""
+            INSERT INTO response_cache (project_id, cache_key, response, expires)
+            VALUES (?, ?, ?, CASE WHEN ? IS NULL THEN NULL ELSE datetime('now', '+' || ? || ' seconds') END)
+            ON CONFLICT(project_id, cache_key) DO UPDATE SET response = excluded.response, expires = excluded.expires;
+        """, (project_id, key, response, self.ttl, self.ttl))
+        cursor.connection.commit()
+
+    def invalidate(self, project_id):
+        cursor = self.get_cursor()
+        cursor.execute("""
+            DELETE FROM response_cache WHERE project_id = ?;
+        """, (project_id, ))
+        cursor.connection.commit()
@@ -0,0 +1,98 @@
+import logging
+from functools import lru_cache
+
+import httpx
+from metrics import counter, gauge
+from utils import get_config
+
+logger = logging.getLogger(__name__)
+
+config = get_config()
+
+requests_in_flight = gauge("chatbot_llm_requests_in_flight", "Requests to the LLM which are currently in flight.")
+requests_peak = gauge("chatbot_llm_requests_peak", "The highest number of requests to the LLM in flight at once.")
+requests_total = counter("chatbot_llm_requests_total", "Requests sent to the LLM.")
+saturated_total = counter("chatbot_llm_pool_saturated_total", "Requests sent while all connections were in use.")
+
+
+def get_client_options():
+    return {
+        "max_connections": 100,
+        "max_keepalive_connections": 20,
+        "keepalive_expiry": 60,
+        "timeout": 120,
+        "retries": 2,
+        **getattr(config, "LLM_CLIENT", {})
+    }
+
+
+class MonitoredStream(httpx.AsyncByteStream):
+    # the connection of a (streamed) response is in use until the response is closed
+
+    def __init__(self, stream, on_close):
+        self.stream = stream
+        self.on_close = on_close
+
+    async def __aiter__(self):
+        async for chunk in self.stream:
+            yield chunk
+
+    async def aclose(self):
+        try:
+            await self.stream.aclose()
+        finally:
+            if self.on_close is not None:
+                self.on_close()
+                self.on_close = None
+
+
+class MonitoredTransport(httpx.AsyncHTTPTransport):
+    # counts the requests in flight to report the saturation of the connection pool
+
+    def __init__(self, max_connections, **kwargs):
+        super().__init__(**kwargs)
+        self.max_connections = max_connections
+        self.in_flight = 0
+
+    async def handle_async_request(self, request):
+        self.in_flight += 1
+        requests_total.inc()
+        requests_in_flight.set(self.in_flight)
+        requests_peak.set(max(self.in_flight, requests_peak.get()))
+
+        if self.in_flight > self.max_connections:
+            saturated_total.inc()
+            logger.warning("All %s connections to the LLM are in use, requests are queued.", self.max_connections)
+
+        try:
+            response = await super().handle_async_request(request)
+        except BaseException:
+            self.release()
+            raise
+
+        response.stream = MonitoredStream(response.stream, self.release)
+        return response
+
+    def release(self):
+        self.in_flight -= 1
+        requests_in_flight.set(self.in_flight)
+
+
+@lru_cache(maxsize=1)
+def get_http_transport():
+    # one transport, and therefore one connection pool, is shared by all sessions of the process
+    options = get_client_options()
+    return MonitoredTransport(
+        max_connections=options["max_connections"],
+        limits=httpx.Limits(
+            max_connections=options["max_connections"],
+            max_keepalive_connections=options["max_keepalive_connections"],
+            keepalive_expiry=options["keepalive_expiry"]
+        ),
+        retries=options["retries"]  # retries failed connection attempts with exponential backoff
+    )
+
+
+@lru_cache(maxsize=1)
+def get_http_client():
+    return httpx.AsyncClient(transport=get_http_transport(), timeout=get_client_options()["timeout"])
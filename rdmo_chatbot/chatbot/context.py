@@ -0,0 +1,79 @@
+import json
+import logging
+from functools import lru_cache
+
+from utils import get_config
+
+logger = logging.getLogger(__name__)
+
+config = get_config()
+
+# rough approximation of the number of characters per token, used if no tokenizer is configured
+CHARS_PER_TOKEN = 4
+
+EMPTY_VALUES = (None, "", [], {})
+
+
+@lru_cache(maxsize=1)
+def get_encoding():
+    tokenizer = getattr(config, "CONTEXT_TOKENIZER", None)
+    if tokenizer:
+        try:
+            import tiktoken
+            return tiktoken.get_encoding(tokenizer)
+        except ImportError:
+            pass
+        except ValueError:
+            # the tokens are estimated, if the name of the tokenizer is unknown
+            logger.warning("Unknown tokenizer %s, the tokens are estimated.", tokenizer)
+
+
+def count_tokens(text):
+    encoding = get_encoding()
+    if encoding is None:
+        return len(text) // CHARS_PER_TOKEN + 1
+    else:
+        return len(encoding.encode(text))
+
+
+def prune(data, exclude=()):
+    # remove empty values and excluded keys recursively
+    if isinstance(data, dict):
+        pruned = {key: prune(value, exclude) for key, value in data.items() if key not in exclude}
+        return {key: value for key, value in pruned.items() if value not in EMPTY_VALUES}
+    elif isinstance(data, list):
+        pruned = [prune(value, exclude) for value in data]
+        return [value for value in pruned if value not in EMPTY_VALUES]
+    else:
+        return data
+
+
+def dumps(data):
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+
+
+def build_context(project, budget=None):
+    budget = budget or getattr(config, "CONTEXT_TOKEN_BUDGET", None)
+    exclude = getattr(config, "CONTEXT_EXCLUDE_KEYS", [])
+
+    project = prune(project, exclude)
+    answers = project.pop("answers", [])
+    if not isinstance(answers, list):
+        answers = [answers]
+
+    # the project itself (id, title, description) is always part of the context
+    lines = [dumps(project)]
+    tokens = count_tokens(lines[0])
+
+    for index, answer in enumerate(answers):
+        line = dumps(answer)
+        line_tokens = count_tokens(line)
+
+        if budget and tokens + line_tokens > budget:
+            lines.append(f"[{len(answers) - index} more answers omitted]")
+            break
+
+        lines.append(line)
+        tokens += line_tokens
+
+    return "\n".join(lines)
@@ -0,0 +1,47 @@
+import asyncio
+import random
+import time
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+WORDS = (
+    "data management plan research project storage archive metadata license repository access backup "
+    "format documentation ethics publication software sharing retention"
+).split()
+
+
+class FakeChatModel(BaseChatModel):
+    # a deterministic chat model for benchmarks, which starts to answer after the latency (in seconds)
+    # and then produces a fixed number of tokens with a fixed rate
+
+    latency: float = 0.5
+    tokens_per_second: float = 50
+    response_tokens: int = 100
+
+    @property
+    def _llm_type(self):
+        return "fake"
+
+    def get_tokens(self, messages):
+        # the same message is always answered with the same response
+        generator = random.Random(str(messages[-1].content))
+        return [generator.choice(WORDS) + " " for _ in range(self.response_tokens)]
+
+    def get_duration(self):
+        return self.latency + self.response_tokens / self.tokens_per_second
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        time.sleep(self.get_duration())
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content="".join(self.get_tokens(messages))))])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        await asyncio.sleep(self.get_duration())
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content="".join(self.get_tokens(messages))))])
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        await asyncio.sleep(self.latency)
+        for token in self.get_tokens(messages):
+            await asyncio.sleep(1 / self.tokens_per_second)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=token))
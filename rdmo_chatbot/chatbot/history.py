@@ -0,0 +1,29 @@
+from context import count_tokens
+from utils import get_config
+
+config = get_config()
+
+
+def get_window_start(history):
+    # returns the index of the first message of the history which is sent to the llm,
+    # limited by the number of turns (pairs of user and assistant messages) and tokens
+    start = 0
+
+    max_turns = getattr(config, "HISTORY_MAX_TURNS", None)
+    if max_turns:
+        start = max(start, len(history) - 2 * max_turns)
+
+    max_tokens = getattr(config, "HISTORY_MAX_TOKENS", None)
+    if max_tokens:
+        tokens = 0
+        for index in range(len(history) - 1, start - 1, -1):
+            tokens += count_tokens(str(history[index].content))
+            if tokens > max_tokens:
+                start = index + 1
+                break
+
+    return start
+
+
+def format_messages(messages):
+    return "\n".join(f"[{message.type}] {message.content}" for message in messages)
@@ -0,0 +1,82 @@
+import inspect
+import time
+from contextlib import contextmanager, nullcontext
+from functools import lru_cache
+
+from metrics import collector, counter, gauge, histogram
+from utils import get_config
+
+config = get_config()
+
+handler_seconds = histogram("chatbot_handler_seconds", "Time spent in the handlers of the adapter.")
+copilot_seconds = histogram("chatbot_copilot_seconds", "Round-trip time of the functions of the copilot.")
+store_seconds = histogram("chatbot_store_seconds", "Time spent reading from and writing to the store.")
+context_seconds = histogram("chatbot_context_seconds", "Time spent building the context for the LLM.")
+first_token_seconds = histogram("chatbot_first_token_seconds", "Time until the first token of the LLM was received.")
+generation_seconds = histogram("chatbot_generation_seconds", "Time until the response of the LLM was complete.")
+input_tokens = counter("chatbot_input_tokens_total", "Tokens sent to the LLM.")
+output_tokens = counter("chatbot_output_tokens_total", "Tokens received from the LLM.")
+
+
+@lru_cache(maxsize=1)
+def get_tracer():
+    # spans are only recorded if enabled, the exporter is configured using the opentelemetry sdk
+    if getattr(config, "TRACING", False):
+        from opentelemetry import trace
+        return trace.get_tracer("rdmo_chatbot")
+
+
+@contextmanager
+def measure(metric, name, **labels):
+    tracer = get_tracer()
+    span = tracer.start_as_current_span(name, attributes=labels) if tracer else nullcontext()
+    started = time.monotonic()
+    with span:
+        try:
+            yield
+        finally:
+            metric.observe(time.monotonic() - started, **labels)
+
+
+def collect_store_stats(store):
+    # in-process stores report their size, hits and evictions when the metrics are rendered
+    @collector
+    def collect():
+        for name, value in store.get_stats().items():
+            gauge(f"chatbot_store_{name}", f"The {name} of the in-process store.").set(value)
+
+
+class InstrumentedStore:
+    # wraps the (async) store and measures the time spent in each of its methods
+
+    def __init__(self, store):
+        self.store = store
+
+    def __getattr__(self, name):
+        attribute = getattr(self.store, name)
+        if name.startswith("_") or not inspect.iscoroutinefunction(attribute):
+            return attribute
+
+        async def method(*args, **kwargs):
+            with measure(store_seconds, f"store.{name}", method=name):
+                return await attribute(*args, **kwargs)
+
+        return method
+
+
+class InstrumentedAdapter:
+    # wraps the adapter and measures the time spent in each of its handlers
+
+    def __init__(self, adapter):
+        self.adapter = adapter
+
+    def __getattr__(self, name):
+        attribute = getattr(self.adapter, name)
+        if not name.startswith("on_") or not inspect.iscoroutinefunction(attribute):
+            return attribute
+
+        async def handler(*args, **kwargs):
+            with measure(handler_seconds, f"adapter.{name}", handler=name):
+                return await attribute(*args, **kwargs)
+
+        return handler
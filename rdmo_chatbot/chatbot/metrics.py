@@ -0,0 +1,120 @@
+from collections import defaultdict
+
+# in-process metrics of the chatbot, the metrics are registered by name,
+# so that they can be looked up again by other modules
+registry = {}
+
+# functions which update metrics right before they are rendered, e.g. from the stats of a store
+collectors = []
+
+
+class Metric:
+
+    type = None
+
+    def __init__(self, name, documentation):
+        self.name = name
+        self.documentation = documentation
+        self.values = defaultdict(float)
+
+    def get(self, **labels):
+        return self.values[tuple(sorted(labels.items()))]
+
+
+class Counter(Metric):
+
+    type = "counter"
+
+    def inc(self, value=1, **labels):
+        self.values[tuple(sorted(labels.items()))] += value
+
+
+class Gauge(Metric):
+
+    type = "gauge"
+
+    def inc(self, value=1, **labels):
+        self.values[tuple(sorted(labels.items()))] += value
+
+    def dec(self, value=1, **labels):
+        self.values[tuple(sorted(labels.items()))] -= value
+
+    def set(self, value, **labels):
+        self.values[tuple(sorted(labels.items()))] = value
+
+
+class Histogram(Metric):
+
+    type = "histogram"
+    buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+    def __init__(self, name, documentation, buckets=None):
+        super().__init__(name, documentation)
+        self.buckets = buckets or self.buckets
+        self.counts = defaultdict(lambda: [0] * len(self.buckets))
+        self.totals = defaultdict(int)
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        self.values[key] += value
+        self.totals[key] += 1
+        for index, bucket in enumerate(self.buckets):
+            if value <= bucket:
+                self.counts[key][index] += 1
+
+    def get_count(self, **labels):
+        return self.totals[tuple(sorted(labels.items()))]
+
+
+def get_metric(metric_class, name, documentation):
+    if name not in registry:
+        registry[name] = metric_class(name, documentation)
+    return registry[name]
+
+
+def counter(name, documentation):
+    return get_metric(Counter, name, documentation)
+
+
+def gauge(name, documentation):
+    return get_metric(Gauge, name, documentation)
+
+
+def histogram(name, documentation):
+    return get_metric(Histogram, name, documentation)
+
+
+def collector(function):
+    collectors.append(function)
+    return function
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (
+        (key, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for key, value in labels
+    )
+    return "{" + ",".join(f'{key}="{value}"' for key, value in escaped) + "}"
+
+
+def render():
+    # renders all metrics in the text format of prometheus
+    for function in collectors:
+        function()
+
+    lines = []
+    for metric in registry.values():
+        lines.append(f"# HELP {metric.name} {metric.documentation}")
+        lines.append(f"# TYPE {metric.name} {metric.type}")
+        for key, value in list(metric.values.items()):
+            if isinstance(metric, Histogram):
+                for bucket, count in zip(metric.buckets, metric.counts[key]):
+                    lines.append(f"{metric.name}_bucket{format_labels((*key, ('le', bucket)))} {count}")
+                lines.append(f"{metric.name}_bucket{format_labels((*key, ('le', '+Inf')))} {metric.totals[key]}")
+                lines.append(f"{metric.name}_sum{format_labels(key)} {value}")
+                lines.append(f"{metric.name}_count{format_labels(key)} {metric.totals[key]}")
+            else:
+                lines.append(f"{metric.name}{format_labels(key)} {value}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,50 @@
+import hashlib
+import re
+
+from context import dumps
+from metrics import counter
+
+hits_total = counter("chatbot_response_cache_hits_total", "Responses which were found in the response cache.")
+misses_total = counter("chatbot_response_cache_misses_total", "Responses which were not found in the response cache.")
+semantic_hits_total = counter("chatbot_semantic_cache_hits_total", "Responses to similar questions found in the cache.")
+semantic_misses_total = counter("chatbot_semantic_cache_misses_total", "Responses not found in the semantic cache.")
+
+CHUNK_PATTERN = re.compile(r"\S+\s*|\s+")
+
+
+def normalize_question(content):
+    # questions which only differ in case, whitespace or trailing punctuation share a cache entry
+    return " ".join(content.lower().split()).rstrip("?!. ")
+
+
+def get_cache_scope(system_prompt, user_identifier):
+    # responses are only shared between the users of a project, if the system prompt does not contain the name of
+    # the user, otherwise the llm might address one user by the name of another
+    return user_identifier if "{user}" in system_prompt else ""
+
+
+def get_history_key(history, history_length=2, scope=""):
+    # only a short tail of the history is used, so that follow-up questions are still told apart
+    messages = [message for message in history if message.type in ["human", "ai"]]
+    messages = messages[-history_length:] if history_length else []
+    data = [scope, [[message.type, message.content] for message in messages]]
+    return hashlib.sha256(dumps(data).encode()).hexdigest()
+
+
+def get_cache_key(system_prompt, inputs, history_length=2, scope=""):
+    # the system prompt is used before the name of the user is filled in, the scope separates the users if needed
+    digest = hashlib.sha256()
+    for part in [
+        system_prompt,
+        hashlib.sha256(inputs["context"].encode()).hexdigest(),
+        get_history_key(inputs["history"], history_length, scope),
+        normalize_question(inputs["content"])
+    ]:
+        digest.update(part.encode())
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def iter_chunks(response):
+    # cached responses are streamed word by word, like the responses of the llm
+    return CHUNK_PATTERN.findall(response)
@@ -0,0 +1,57 @@
+import asyncio
+import logging
+
+from metrics import counter
+from utils import get_config
+
+logger = logging.getLogger(__name__)
+
+config = get_config()
+
+purged_total = counter("chatbot_store_purged_total", "Expired histories which were removed from the store.")
+
+
+async def purge_expired(store, ttl, batch_size=1000, pause=0):
+    # removes the expired histories in batches, so that the tables are not locked for long
+    total = 0
+    while True:
+        count = await store.purge_expired(ttl, batch_size)
+        total += count
+        purged_total.inc(count)
+        if count < batch_size:
+            return total
+        await asyncio.sleep(pause)
+
+
+class Sweeper:
+    # purges the expired histories of the store periodically, in the background of the chatbot process
+
+    def __init__(self, store, ttl, interval, batch_size=1000, pause=0.1):
+        self.store = store
+        self.ttl = ttl
+        self.interval = interval
+        self.batch_size = batch_size
+        self.pause = pause
+        self.task = None
+
+    def start(self):
+        # the task is started lazily, since it needs a running event loop
+        if self.task is None:
+            self.task = asyncio.create_task(self.sweep())
+
+    async def sweep(self):
+        while True:
+            try:
+                count = await purge_expired(self.store, self.ttl, self.batch_size, self.pause)
+                if count:
+                    logger.info("Purged %s expired histories.", count)
+            except Exception:
+                logger.exception("Purging the expired histories failed.")
+            await asyncio.sleep(self.interval)
+
+
+def get_sweeper(store):
+    interval = getattr(config, "STORE_PURGE_INTERVAL", None)
+    ttl = getattr(config, "STORE_TTL", None)
+    if interval and ttl and hasattr(store, "purge_expired"):
+        return Sweeper(store, ttl, interval, batch_size=getattr(config, "STORE_PURGE_BATCH_SIZE", 1000))
@@ -0,0 +1,221 @@
+import asyncio
+import hashlib
+import importlib
+import logging
+import math
+import re
+from collections import Counter, OrderedDict, defaultdict
+from functools import lru_cache
+
+from context import dumps, prune
+from utils import get_config
+
+logger = logging.getLogger(__name__)
+
+config = get_config()
+
+TOKEN_PATTERN = re.compile(r"\w+")
+
+# the number of project indexes kept in memory
+MAX_INDEXES = 128
+
+
+def tokenize(text):
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+def normalize(vector):
+    norm = math.sqrt(sum(value * value for value in vector)) or 1
+    return [value / norm for value in vector]
+
+
+class BM25Index:
+
+    def __init__(self, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings = defaultdict(dict)  # term -> {key: term frequency}
+        self.terms = {}  # key -> terms of the document
+        self.lengths = {}  # key -> document length
+        self.total_length = 0
+
+    def __contains__(self, key):
+        return key in self.lengths
+
+    def add(self, key, text):
+        terms = Counter(tokenize(text))
+        for term, frequency in terms.items():
+            self.postings[term][key] = frequency
+
+        self.terms[key] = list(terms)
+        self.lengths[key] = sum(terms.values())
+        self.total_length += self.lengths[key]
+
+    def remove(self, key):
+        for term in self.terms.pop(key):
+            postings = self.postings[term]
+            del postings[key]
+            if not postings:
+                del self.postings[term]
+
+        self.total_length -= self.lengths.pop(key)
+
+    def search(self, query):
+        if not self.lengths:
+            return {}
+
+        count = len(self.lengths)
+        average_length = self.total_length / count or 1
+
+        scores = defaultdict(float)
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+
+            idf = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+            for key, frequency in postings.items():
+                norm = self.k1 * (1 - self.b + self.b * self.lengths[key] / average_length)
+                scores[key] += idf * frequency * (self.k1 + 1) / (frequency + norm)
+
+        return scores
+
+
+class EmbeddingIndex:
+
+    def __init__(self, embeddings):
+        self.embeddings = embeddings
+        self.vectors = {}  # key -> normalized vector
+
+    def __contains__(self, key):
+        return key in self.vectors
+
+    async def add(self, documents):
+        if documents:
+            keys, texts = zip(*documents.items())
+            vectors = await self.embeddings.aembed_documents(list(texts))
+            self.vectors.update(zip(keys, map(normalize, vectors)))
+
+    def remove(self, key):
+        self.vectors.pop(key, None)
+
+    async def search(self, query):
+        if not self.vectors:
+            return {}
+
+        vector = normalize(await self.embeddings.aembed_query(query))
+        keys = list(self.vectors)
+
+        try:
+            import numpy as np
+            similarities = np.array([self.vectors[key] for key in keys]) @ np.array(vector)
+        except ImportError:
+            similarities = [sum(a * b for a, b in zip(self.vectors[key], vector)) for key in keys]
+
+        return dict(zip(keys, map(float, similarities)))
+
+
+class ProjectIndex:
+
+    def __init__(self, embeddings=None):
+        self.answers = {}
+        self.last_answers = None
+        self.bm25 = BM25Index()
+        self.embedding = EmbeddingIndex(embeddings) if embeddings else None
+        self.embedding_ready = False
+        # the index is shared by all sessions of the project, updates must not overlap
+        self.lock = asyncio.Lock()
+
+    async def update(self, answers):
+        async with self.lock:
+            if answers is self.last_answers:
+                return
+
+            # the answers are identified by a hash of their content, so that only
+            # changed answers need to be removed and added to the indexes
+            documents = {}
+            for answer in answers:
+                text = dumps(prune(answer))
+                key = hashlib.sha1(text.encode()).hexdigest()
+                documents[key] = text
+                self.answers[key] = answer
+
+            for key in set(self.answers) - set(documents):
+                del self.answers[key]
+                self.bm25.remove(key)
+                if self.embedding:
+                    self.embedding.remove(key)
+
+            for key, text in documents.items():
+                if key not in self.bm25:
+                    self.bm25.add(key, text)
+
+            if self.embedding:
+                try:
+                    await self.embedding.add({
+                        key: text for key, text in documents.items() if key not in self.embedding
+                    })
+                except Exception:
+                    # only bm25 is used, the embeddings are added again with the next update
+                    logger.exception("Could not embed the answers, falling back to BM25")
+                    self.embedding_ready = False
+                    return
+
+                self.embedding_ready = True
+
+            self.last_answers = answers
+
+    async def search(self, query, k):
+        rankings = [self.bm25.search(query)]
+        if self.embedding and self.embedding_ready:
+            try:
+                rankings.append(await self.embedding.search(query))
+            except Exception:
+                logger.exception("Could not embed the query, falling back to BM25")
+
+        # combine the rankings using reciprocal rank fusion
+        scores = defaultdict(float)
+        for ranking in rankings:
+            for rank, key in enumerate(sorted(ranking, key=ranking.get, reverse=True)):
+                scores[key] += 1 / (60 + rank)
+
+        # answers without any score are appended in their original order, answers which
+        # were removed by an update while the query was embedded are skipped
+        keys = [key for key in sorted(scores, key=scores.get, reverse=True) if key in self.answers]
+        keys += [key for key in self.answers if key not in scores]
+
+        return [self.answers[key] for key in keys[:k]]
+
+
+indexes = OrderedDict()
+
+
+@lru_cache(maxsize=1)
+def get_embeddings():
+    embeddings = getattr(config, "CONTEXT_EMBEDDINGS", None)
+    if embeddings:
+        embeddings_module_name, embeddings_class_name = embeddings.rsplit(".", 1)
+        embeddings_module = importlib.import_module(embeddings_module_name)
+        embeddings_class = getattr(embeddings_module, embeddings_class_name)
+        return embeddings_class(**getattr(config, "CONTEXT_EMBEDDINGS_ARGS", {}))
+
+
+def get_index(project_id):
+    if project_id in indexes:
+        indexes.move_to_end(project_id)
+    else:
+        indexes[project_id] = ProjectIndex(get_embeddings())
+        if len(indexes) > MAX_INDEXES:
+            indexes.popitem(last=False)
+
+    return indexes[project_id]
+
+
+async def search_answers(project, query, k):
+    answers = project.get("answers")
+    if not isinstance(answers, list):
+        return answers
+
+    index = get_index(project.get("id"))
+    await index.update(answers)
+    return await index.search(query, k)
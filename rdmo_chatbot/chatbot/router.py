@@ -0,0 +1,160 @@
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager
+
+from clients import get_http_client
+from metrics import counter, gauge
+
+logger = logging.getLogger(__name__)
+
+backend_outstanding = gauge("chatbot_router_outstanding", "Requests in flight for each backend.")
+backend_latency = gauge("chatbot_router_latency_seconds", "Average time to the first token for each backend.")
+backend_circuit_open = gauge("chatbot_router_circuit_open", "Whether the circuit breaker of a backend is open.")
+backend_requests = counter("chatbot_router_requests_total", "Requests sent to each backend.")
+backend_failures = counter("chatbot_router_failures_total", "Failed requests for each backend.")
+
+# the weight of a new measurement in the moving average of the latency
+LATENCY_WEIGHT = 0.2
+
+
+class BackendUnavailable(Exception):
+    pass
+
+
+class Backend:
+
+    def __init__(self, name, llm, health_url=None):
+        self.name = name
+        self.llm = llm
+        self.health_url = health_url
+        self.outstanding = 0
+        self.latency = None
+        self.failures = 0
+        self.opened = None  # the time the circuit was opened
+        self.trial = False  # whether a trial request is in flight, while the circuit is half-open
+
+    def update_latency(self, latency):
+        if self.latency is None:
+            self.latency = latency
+        else:
+            self.latency = LATENCY_WEIGHT * latency + (1 - LATENCY_WEIGHT) * self.latency
+        backend_latency.set(self.latency, backend=self.name)
+
+
+class Request:
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.latency = None
+
+    def first_token(self):
+        if self.latency is None:
+            self.latency = time.monotonic() - self.started
+
+
+class Router:
+    # distributes the requests over several backends, backends which fail repeatedly are skipped (the circuit is
+    # opened) until the cooldown has passed, then a single trial request or a successful health probe closes it
+
+    def __init__(self, backends, strategy="least_outstanding", failure_threshold=3, cooldown=30, probe_interval=10):
+        self.backends = backends
+        self.strategy = strategy
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.probe_interval = probe_interval
+        self.probe_task = None
+
+    def is_available(self, backend, now):
+        if backend.opened is None:
+            return True
+        return now - backend.opened >= self.cooldown and not backend.trial
+
+    def get_score(self, backend):
+        if self.strategy == "latency":
+            # backends without measurements are assumed to be as fast as the fastest backend
+            latencies = [backend.latency for backend in self.backends if backend.latency is not None]
+            latency = backend.latency if backend.latency is not None else min(latencies, default=1)
+            return (backend.outstanding + 1) * latency
+        else:
+            return backend.outstanding
+
+    def select(self, exclude=()):
+        self.start_probing()
+
+        now = time.monotonic()
+        backends = [
+            backend for backend in self.backends
+            if backend not in exclude and self.is_available(backend, now)
+        ]
+        if not backends:
+            return None
+
+        backend = min(backends, key=self.get_score)
+        if backend.opened is not None:
+            backend.trial = True
+        return backend
+
+    @asynccontextmanager
+    async def request(self, backend):
+        request = Request()
+        backend.outstanding += 1
+        backend_outstanding.set(backend.outstanding, backend=backend.name)
+        backend_requests.inc(backend=backend.name)
+        try:
+            yield request
+        except asyncio.CancelledError:
+            backend.trial = False
+            raise
+        except Exception:
+            self.record_failure(backend)
+            raise
+        else:
+            self.record_success(backend)
+            backend.update_latency(request.latency or time.monotonic() - request.started)
+        finally:
+            backend.outstanding -= 1
+            backend_outstanding.set(backend.outstanding, backend=backend.name)
+
+    def record_success(self, backend):
+        if backend.opened is not None:
+            logger.info("Backend %s has recovered.", backend.name)
+        backend.failures = 0
+        backend.opened = None
+        backend.trial = False
+        backend_circuit_open.set(0, backend=backend.name)
+
+    def record_failure(self, backend):
+        backend.failures += 1
+        backend.trial = False
+        backend_failures.inc(backend=backend.name)
+        if backend.opened is not None or backend.failures >= self.failure_threshold:
+            self.open_circuit(backend)
+
+    def open_circuit(self, backend):
+        if backend.opened is None:
+            logger.warning("Backend %s is not available, it is skipped for now.", backend.name)
+        backend.opened = time.monotonic()
+        backend_circuit_open.set(1, backend=backend.name)
+
+    def start_probing(self):
+        if self.probe_task is None and self.probe_interval and any(backend.health_url for backend in self.backends):
+            self.probe_task = asyncio.create_task(self.probe())
+
+    async def probe(self):
+        while True:
+            await asyncio.gather(*[
+                self.probe_backend(backend) for backend in self.backends if backend.health_url
+            ])
+            await asyncio.sleep(self.probe_interval)
+
+    async def probe_backend(self, backend):
+        try:
+            response = await get_http_client().get(backend.health_url, timeout=self.probe_interval)
+            response.raise_for_status()
+        except Exception:
+            # a failing probe opens the circuit at once
+            self.open_circuit(backend)
+        else:
+            if backend.opened is not None and not backend.trial:
+                self.record_success(backend)
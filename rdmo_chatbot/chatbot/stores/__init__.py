@@ -1,13 +1,163 @@
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
 class BaseStore:
 
+    # whether the methods of the store perform blocking I/O
+    blocking = True
+
+    # the number of threads the store is run in by the AsyncStoreWrapper
+    max_workers = 1
+
     def has_history(self, user_identifier, project_id):
         raise NotImplementedError
 
-    def get_history(self, user_identifier, project_id):
+    def get_history(self, user_identifier, project_id, limit=None, before=None):
+        # return the last `limit` messages before the message with the id `before`
         raise NotImplementedError
 
     def set_history(self, user_identifier, project_id, history):
         raise NotImplementedError
 
+    def append_messages(self, user_identifier, project_id, messages):
+        raise NotImplementedError
+
     def reset_history(self, user_identifier, project_id):
         raise NotImplementedError
+
+    def get_summary(self, user_identifier, project_id):
+        raise NotImplementedError
+
+    def set_summary(self, user_identifier, project_id, summary, count):
+        raise NotImplementedError
+
+
+class AsyncBaseStore:
+
+    async def has_history(self, user_identifier, project_id):
+        raise NotImplementedError
+
+    async def get_history(self, user_identifier, project_id, limit=None, before=None):
+        raise NotImplementedError
+
+    async def set_history(self, user_identifier, project_id, history):
+        raise NotImplementedError
+
+    async def append_messages(self, user_identifier, project_id, messages):
+        raise NotImplementedError
+
+    async def reset_history(self, user_identifier, project_id):
+        raise NotImplementedError
+
+    async def get_summary(self, user_identifier, project_id):
+        raise NotImplementedError
+
+    async def set_summary(self, user_identifier, project_id, summary, count):
+        raise NotImplementedError
+
+
+class AsyncStoreWrapper(AsyncBaseStore):
+    # wraps a synchronous store, blocking stores are run in a thread pool,
+    # so that their I/O does not block the event loop
+
+    def __init__(self, store):
+        self.store = store
+        self.executor = None
+        if getattr(store, "blocking", True):
+            self.executor = ThreadPoolExecutor(getattr(store, "max_workers", 1), thread_name_prefix="store")
+
+    async def run(self, method, *args, **kwargs):
+        function = functools.partial(getattr(self.store, method), *args, **kwargs)
+        if self.executor is None:
+            return function()
+        else:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, function)
+
+    async def has_history(self, user_identifier, project_id):
+        return await self.run("has_history", user_identifier, project_id)
+
+    async def get_history(self, user_identifier, project_id, limit=None, before=None):
+        return await self.run("get_history", user_identifier, project_id, limit=limit, before=before)
+
+    async def set_history(self, user_identifier, project_id, history):
+        return await self.run("set_history", user_identifier, project_id, history)
+
+    async def append_messages(self, user_identifier, project_id, messages):
+        return await self.run("append_messages", user_identifier, project_id, messages)
+
+    async def reset_history(self, user_identifier, project_id):
+        return await self.run("reset_history", user_identifier, project_id)
+
+    async def get_summary(self, user_identifier, project_id):
+        return await self.run("get_summary", user_identifier, project_id)
+
+    async def set_summary(self, user_identifier, project_id, summary, count):
+        return await self.run("set_summary", user_identifier, project_id, summary, count)
+
+    def __getattr__(self, name):
+        # purge_expired is optional and only available if the store implements it
+        if name == "purge_expired" and hasattr(self.__dict__.get("store"), name):
+            return functools.partial(self.run, name)
+        raise AttributeError(name)
+
+
+class ThreadLocalConnection:
+    # keeps one connection for each thread of the AsyncStoreWrapper, so that the threads
+    # form a pool of connections, connections which fail the check are re-opened
+
+    def __init__(self, connect, check=None):
+        self.connect = connect
+        self.check = check
+        self.local = threading.local()
+
+    def get(self):
+        connection = getattr(self.local, "connection", None)
+
+        if connection is not None and self.check is not None:
+            try:
+                self.check(connection)
+            except Exception:
+                self.close(connection)
+                connection = None
+
+        if connection is None:
+            connection = self.local.connection = self.connect()
+
+        return connection
+
+    def reset(self):
+        # closes the connection of the current thread, the next call to get opens a new one
+        connection = getattr(self.local, "connection", None)
+        if connection is not None:
+            self.close(connection)
+            self.local.connection = None
+
+    def close(self, connection):
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+
+def reconnect(method):
+    # retries the method once with a new connection, if the connection was lost during a query,
+    # the transaction of the failed attempt was not committed and is rolled back by the server
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        try:
+            return method(self, *args, **kwargs)
+        except self.connection_errors:
+            self.connection.reset()
+            return method(self, *args, **kwargs)
+
+    return wrapper
+
+
+def get_connection_kwargs(connection, pool_size=4):
+    # the size of the pool can be configured in CHATBOT_STORE_CONNECTION using "pool_size",
+    # the remaining keys are passed to the database driver
+    kwargs = dict(connection)
+    return kwargs, kwargs.pop("pool_size", pool_size)
@@ -1,29 +1,139 @@
+import json
+import time
+from collections import OrderedDict
+
+from ..utils import decode_messages, encode_message, get_config
 from . import BaseStore
 
+config = get_config()
+
+
+class Entry:
+    # the history of one user and project, the messages are kept serialized to save memory
+
+    __slots__ = ("expires", "messages", "size", "summary")
+
+    def __init__(self):
+        self.messages = []
+        self.summary = None
+        self.size = 0
+        self.expires = None
+
 
 class LocMemStore(BaseStore):
+    # an in-process store, the histories are evicted when they expire or,
+    # least recently used first, when the store exceeds its limits
+
+    blocking = False
 
     _instance = None
-    _store = {}
 
     def __new__(cls, *args, **kwargs):
         if cls._instance is None:
             cls._instance = super().__new__(cls)
-            cls._instance.data = {}
+            cls._instance.setup()
         return cls._instance
 
+    def setup(self):
+        self.max_entries = getattr(config, "STORE_MAX_ENTRIES", 10000)
+        self.max_bytes = getattr(config, "STORE_MAX_BYTES", None)
+        self.ttl = getattr(config, "STORE_TTL", None)
+        self.compression = getattr(config, "STORE_COMPRESSION", None)
+        self.entries = OrderedDict()  # (user_identifier, project_id) -> Entry
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get_stats(self):
+        return {
+            "entries": len(self.entries),
+            "bytes": self.bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations
+        }
+
+    def get_entry(self, user_identifier, project_id, create=False):
+        key = (user_identifier, project_id)
+        entry = self.entries.get(key)
+
+        if entry is not None and entry.expires is not None and entry.expires < time.monotonic():
+            self.remove_entry(key)
+            self.expirations += 1
+            entry = None
+
+        if entry is None:
+            if not create:
+                return None
+            entry = self.entries[key] = Entry()
+
+        self.entries.move_to_end(key)
+        return entry
+
+    def resize_entry(self, entry, size):
+        # the ttl is renewed on every write, like in the redis store
+        self.bytes += size - entry.size
+        entry.size = size
+        entry.expires = time.monotonic() + self.ttl if self.ttl else None
+        self.evict()
+
+    def remove_entry(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.bytes -= entry.size
+
+    def evict(self):
+        # evict the least recently used entries, the entry which was just written is the last one and is kept
+        while len(self.entries) > 1 and (
+            len(self.entries) > self.max_entries or (self.max_bytes and self.bytes > self.max_bytes)
+        ):
+            self.remove_entry(next(iter(self.entries)))
+            self.evictions += 1
+
+    def encode(self, message):
+        message_data = encode_message(message, self.compression)
+        return message_data.encode() if isinstance(message_data, str) else message_data
+
     def has_history(self, user_identifier, project_id):
-        return self._store.get(user_identifier, {}).get(project_id) is not None
+        return self.get_entry(user_identifier, project_id) is not None
 
-    def get_history(self, user_identifier, project_id):
-        return self._store.get(user_identifier, {}).get(project_id , [])
+    def get_history(self, user_identifier, project_id, limit=None, before=None):
+        entry = self.get_entry(user_identifier, project_id)
+        if entry is None:
+            self.misses += 1
+            return []
+
+        self.hits += 1
+
+        # the messages are identified by their index in the list
+        end = len(entry.messages) if before is None else int(before)
+        start = 0 if limit is None else max(end - limit, 0)
+
+        return decode_messages(enumerate(entry.messages[start:end], start=start))
 
     def set_history(self, user_identifier, project_id, history):
-        if user_identifier not in self._store:
-            self._store[user_identifier] = {}
+        entry = self.get_entry(user_identifier, project_id, create=True)
+        entry.messages = [self.encode(message) for message in history]
+        self.resize_entry(entry, sum(map(len, entry.messages)) + len(entry.summary or b""))
 
-        self._store[user_identifier][project_id] = history
+    def append_messages(self, user_identifier, project_id, messages):
+        entry = self.get_entry(user_identifier, project_id, create=True)
+        messages = [self.encode(message) for message in messages]
+        entry.messages.extend(messages)
+        self.resize_entry(entry, entry.size + sum(map(len, messages)))
 
     def reset_history(self, user_identifier, project_id):
-        if self.has_history(user_identifier, project_id):
-            del self._store[user_identifier][project_id]
+        self.remove_entry((user_identifier, project_id))
+
+    def get_summary(self, user_identifier, project_id):
+        entry = self.get_entry(user_identifier, project_id)
+        return tuple(json.loads(entry.summary)) if entry is not None and entry.summary else None
+
+    def set_summary(self, user_identifier, project_id, summary, count):
+        entry = self.get_entry(user_identifier, project_id, create=True)
+        size = entry.size - len(entry.summary or b"")
+        entry.summary = json.dumps([summary, count]).encode()
+        self.resize_entry(entry, size + len(entry.summary))
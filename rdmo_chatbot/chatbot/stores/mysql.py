@@ -2,20 +2,36 @@ import json
 
 import MySQLdb
 
-from ..utils import dicts_to_messages, get_config, messages_to_dicts
-from . import BaseStore
+from ..utils import decode_messages, dicts_to_messages, encode_message, get_config
+from . import BaseStore, ThreadLocalConnection, get_connection_kwargs, reconnect
 
 config = get_config()
 
+
 class MysqlStore(BaseStore):
 
+    connection_errors = (MySQLdb.OperationalError, MySQLdb.InterfaceError)
+
     def __init__(self):
-        self.connection = MySQLdb.connect(**config.STORE_CONNECTION)
-        self.cursor = self.connection.cursor()
+        self.connection_kwargs, self.max_workers = get_connection_kwargs(config.STORE_CONNECTION)
+        self.connection = ThreadLocalConnection(self.connect, check=self.check)
         self.create_table()
+        # the tables are created in the main thread, whose connection is not used afterwards
+        self.connection.reset()
+
+    def connect(self):
+        return MySQLdb.connect(**self.connection_kwargs)
+
+    def check(self, connection):
+        # raises an OperationalError if the connection to the server was lost
+        connection.ping()
+
+    def get_cursor(self):
+        return self.connection.get().cursor()
 
     def create_table(self):
-        self.cursor.execute("""
+        cursor = self.get_cursor()
+        cursor.execute("""
             CREATE TABLE IF NOT EXISTS history (
                 id INT AUTO_INCREMENT PRIMARY KEY,
                 user_identifier VARCHAR(150),
@@ -23,39 +39,186 @@ class MysqlStore(BaseStore):
                 messages JSON,
                 created TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                 updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+                UNIQUE KEY unique_user_project (user_identifier, project_id),
+                INDEX history_updated (updated)
+            );
+        """)
+        # the index is added to tables which were created by earlier versions
+        cursor.execute("""
+            SELECT count(*) FROM information_schema.statistics
+            WHERE table_schema = DATABASE() AND table_name = 'history' AND index_name = 'history_updated';
+        """)
+        if cursor.fetchone()[0] == 0:
+            cursor.execute("""
+                CREATE INDEX history_updated ON history (updated);
+            """)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS message (
+                id INT AUTO_INCREMENT PRIMARY KEY,
+                user_identifier VARCHAR(150),
+                project_id INT,
+                message JSON,
+                created TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                INDEX message_user_project (user_identifier, project_id, id)
+            );
+        """)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS summary (
+                id INT AUTO_INCREMENT PRIMARY KEY,
+                user_identifier VARCHAR(150),
+                project_id INT,
+                summary TEXT,
+                message_count INTEGER,
+                created TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
                 UNIQUE KEY unique_user_project (user_identifier, project_id)
             );
         """)
-        self.connection.commit()
+        cursor.connection.commit()
 
+    @reconnect
     def has_history(self, user_identifier, project_id):
-        self.cursor.execute("""
+        cursor = self.get_cursor()
+        cursor.execute("""
             SELECT count(*) FROM history WHERE user_identifier = %s AND project_id = %s;
         """, (user_identifier, project_id)
         )
-        result = self.cursor.fetchone()
+        result = cursor.fetchone()
+        cursor.connection.commit()
         return result[0] > 0 if result else False
 
-    def get_history(self, user_identifier, project_id):
-        self.cursor.execute("""
-            SELECT messages FROM history WHERE user_identifier = %s AND project_id = %s;
-        """, (user_identifier, project_id)
-        )
-        result = self.cursor.fetchone()
-        return dicts_to_messages(json.loads(result[0])) if result else []
+    @reconnect
+    def get_history(self, user_identifier, project_id, limit=None, before=None):
+        cursor = self.get_cursor()
+        sql = """
+            SELECT id, message FROM message WHERE user_identifier = %s AND project_id = %s
+        """
+        params = [user_identifier, project_id]
+        if before is not None:
+            sql += " AND id < %s"
+            params.append(int(before))
+        sql += " ORDER BY id DESC"
+        if limit is not None:
+            sql += " LIMIT %s"
+            params.append(limit)
+
+        cursor.execute(sql, params)
+        rows = cursor.fetchall()
+        cursor.connection.commit()
 
+        if not rows and before is None and self.migrate_history(cursor, user_identifier, project_id):
+            return self.get_history(user_identifier, project_id, limit, before)
+
+        return decode_messages(rows[::-1])
+
+    @reconnect
     def set_history(self, user_identifier, project_id, messages):
-        self.cursor.execute("""
-            INSERT INTO history (user_identifier, project_id, messages, created) VALUES (%s, %s, %s, CURRENT_TIMESTAMP)
+        cursor = self.get_cursor()
+        cursor.execute("""
+            DELETE FROM message WHERE user_identifier = %s AND project_id = %s;
+        """, (user_identifier, project_id))
+        cursor.execute("""
+            UPDATE history SET messages = NULL WHERE user_identifier = %s AND project_id = %s;
+        """, (user_identifier, project_id))
+        self.insert_messages(cursor, user_identifier, project_id, messages)
+        cursor.connection.commit()
+
+    @reconnect
+    def append_messages(self, user_identifier, project_id, messages):
+        cursor = self.get_cursor()
+        self.migrate_history(cursor, user_identifier, project_id)
+        self.insert_messages(cursor, user_identifier, project_id, messages)
+        cursor.connection.commit()
+
+    def insert_messages(self, cursor, user_identifier, project_id, messages):
+        # the messages are not compressed, since the json column of mysql cannot store binary data
+        cursor.executemany("""
+            INSERT INTO message (user_identifier, project_id, message) VALUES (%s, %s, %s);
+        """, [(user_identifier, project_id, encode_message(message)) for message in messages])
+        cursor.execute("""
+            INSERT INTO history (user_identifier, project_id) VALUES (%s, %s)
             ON DUPLICATE KEY UPDATE
-                messages = VALUES(messages),
                 updated = CURRENT_TIMESTAMP;
-        """, (user_identifier, project_id, json.dumps(messages_to_dicts(messages))))
-        self.connection.commit()
+        """, (user_identifier, project_id))
 
+    def migrate_history(self, cursor, user_identifier, project_id):
+        # move the messages of histories stored by earlier versions to the message table
+        cursor.execute("""
+            SELECT messages FROM history WHERE user_identifier = %s AND project_id = %s AND messages IS NOT NULL;
+        """, (user_identifier, project_id))
+        result = cursor.fetchone()
+        if not result:
+            return False
+
+        cursor.execute("""
+            UPDATE history SET messages = NULL WHERE user_identifier = %s AND project_id = %s;
+        """, (user_identifier, project_id))
+        self.insert_messages(cursor, user_identifier, project_id, dicts_to_messages(json.loads(result[0])))
+        cursor.connection.commit()
+        return True
+
+    @reconnect
+    def purge_expired(self, ttl, batch_size=1000):
+        # removes one batch of histories which were not updated within the ttl, returns the number of histories
+        cursor = self.get_cursor()
+        cursor.execute("""
+            SELECT user_identifier, project_id FROM history
+            WHERE updated < NOW() - INTERVAL %s SECOND ORDER BY updated LIMIT %s;
+        """, (int(ttl), batch_size))
+        rows = cursor.fetchall()
+
+        # the expiry is checked again, in case a history was updated after it was selected,
+        # the messages and the summary are only removed together with their history
+        count = 0
+        for user_identifier, project_id in rows:
+            cursor.execute("""
+                DELETE FROM history
+                WHERE user_identifier = %s AND project_id = %s AND updated < NOW() - INTERVAL %s SECOND;
+            """, (user_identifier, project_id, int(ttl)))
+            if cursor.rowcount:
+                cursor.execute("""
+                    DELETE FROM message WHERE user_identifier = %s AND project_id = %s;
+                """, (user_identifier, project_id))
+                cursor.execute("""
+                    DELETE FROM summary WHERE user_identifier = %s AND project_id = %s;
+                """, (user_identifier, project_id))
+                count += 1
+        cursor.connection.commit()
+        return count
+
+    @reconnect
     def reset_history(self, user_identifier, project_id):
-        self.cursor.execute("""
+        cursor = self.get_cursor()
+        cursor.execute("""
             DELETE FROM history WHERE user_identifier = %s AND project_id = %s;
         """, [user_identifier, project_id]
         )
-        self.connection.commit()
+        cursor.execute("""
+            DELETE FROM message WHERE user_identifier = %s AND project_id = %s;
+        """, (user_identifier, project_id))
+        cursor.execute("""
+            DELETE FROM summary WHERE user_identifier = %s AND project_id = %s;
+        """, (user_identifier, project_id))
+        cursor.connection.commit()
+
+    @reconnect
+    def get_summary(self, user_identifier, project_id):
+        cursor = self.get_cursor()
+        cursor.execute("""
+            SELECT summary, message_count FROM summary WHERE user_identifier = %s AND project_id = %s;
+        """, (user_identifier, project_id))
+        result = cursor.fetchone()
+        cursor.connection.commit()
+        return tuple(result) if result else None
+
+    @reconnect
+    def set_summary(self, user_identifier, project_id, summary, count):
+        cursor = self.get_cursor()
+        cursor.execute("""
+            INSERT INTO summary (user_identifier, project_id, summary, message_count) VALUES (%s, %s, %s, %s)
+            ON DUPLICATE KEY UPDATE
+                summary = VALUES(summary),
+                message_count = VALUES(message_count),
+                updated = CURRENT_TIMESTAMP;
+        """, (user_identifier, project_id, summary, count))
+        cursor.connection.commit()
@@ -1,22 +1,39 @@
-import json
+import asyncio
 
 import psycopg
+from psycopg_pool import AsyncConnectionPool
 
-from ..utils import dicts_to_messages, get_config, messages_to_dicts
-from . import BaseStore
+from ..utils import decode_messages, dicts_to_messages, encode_message, get_config
+from . import AsyncBaseStore, BaseStore, ThreadLocalConnection, get_connection_kwargs, reconnect
 
 config = get_config()
 
 
 class PostgresStore(BaseStore):
-    def __init__(self):
 
-        self.connection = psycopg.connect(**config.STORE_CONNECTION)
-        self.cursor = self.connection.cursor()
+    connection_errors = (psycopg.OperationalError, psycopg.InterfaceError)
+
+    def __init__(self):
+        self.connection_kwargs, self.max_workers = get_connection_kwargs(config.STORE_CONNECTION)
+        self.connection = ThreadLocalConnection(self.connect, check=self.check)
         self.create_table()
+        # the tables are created in the main thread, whose connection is not used afterwards
+        self.connection.reset()
+
+    def connect(self):
+        return psycopg.connect(**self.connection_kwargs)
+
+    def check(self, connection):
+        # psycopg marks the connection as broken if the connection to the server was lost
+        if connection.closed or connection.broken:
+            raise psycopg.OperationalError("the connection was lost")
+
+    def get_cursor(self):
+        return self.connection.get().cursor()
 
     def create_table(self):
-        self.cursor.execute("""
+        cursor = self.get_cursor()
+        cursor.execute("""
             CREATE TABLE IF NOT EXISTS history (
                 id INT GENERATED ALWAYS AS IDENTITY PRIMARY KEY,
                 user_identifier VARCHAR(150),
@@ -27,33 +44,376 @@ class PostgresStore(BaseStore):
                 UNIQUE (user_identifier, project_id)
             );
         """)
-        self.connection.commit()
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS message (
+                id INT GENERATED ALWAYS AS IDENTITY PRIMARY KEY,
+                user_identifier VARCHAR(150),
+                project_id INT,
+                message JSONB,
+                created TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            );
+        """)
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS message_user_project ON message (user_identifier, project_id, id);
+        """)
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS history_updated ON history (updated);
+        """)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS summary (
+                id INT GENERATED ALWAYS AS IDENTITY PRIMARY KEY,
+                user_identifier VARCHAR(150),
+                project_id INT,
+                summary TEXT,
+                message_count INTEGER,
+                created TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                UNIQUE (user_identifier, project_id)
+            );
+        """)
+        cursor.connection.commit()
 
+    @reconnect
     def has_history(self, user_identifier, project_id):
-        self.cursor.execute("""
+        cursor = self.get_cursor()
+        cursor.execute("""
             SELECT count(*) FROM history WHERE user_identifier = %s AND project_id = %s;
         """, (user_identifier, project_id))
-        result = self.cursor.fetchone()
+        result = cursor.fetchone()
+        cursor.connection.commit()
         return result[0] > 0 if result else False
 
-    def get_history(self, user_identifier, project_id):
-        self.cursor.execute("""
-            SELECT messages FROM history WHERE user_identifier = %s AND project_id = %s;
-        """, (user_identifier, project_id))
-        result = self.cursor.fetchone()
-        return dicts_to_messages(result[0]) if result else []
+    @reconnect
+    def get_history(self, user_identifier, project_id, limit=None, before=None):
+        cursor = self.get_cursor()
+        sql = """
+            SELECT id, message FROM message WHERE user_identifier = %s AND project_id = %s
+        """
+        params = [user_identifier, project_id]
+        if before is not None:
+            sql += " AND id < %s"
+            params.append(int(before))
+        sql += " ORDER BY id DESC"
+        if limit is not None:
+            sql += " LIMIT %s"
+            params.append(limit)
+
+        cursor.execute(sql, params)
+        rows = cursor.fetchall()
+        # end the transaction, so that the thread's connection is not left idle in transaction
+        cursor.connection.commit()
 
+        if not rows and before is None and self.migrate_history(cursor, user_identifier, project_id):
+            return self.get_history(user_identifier, project_id, limit, before)
+
+        return decode_messages(rows[::-1])
+
+    @reconnect
     def set_history(self, user_identifier, project_id, messages):
-        self.cursor.execute("""
-            INSERT INTO history (user_identifier, project_id, messages, created) VALUES (%s, %s, %s, CURRENT_TIMESTAMP)
+        cursor = self.get_cursor()
+        cursor.execute("""
+            DELETE FROM message WHERE user_identifier = %s AND project_id = %s;
+        """, (user_identifier, project_id))
+        cursor.execute("""
+            UPDATE history SET messages = NULL WHERE user_identifier = %s AND project_id = %s;
+        """, (user_identifier, project_id))
+        self.insert_messages(cursor, user_identifier, project_id, messages)
+        cursor.connection.commit()
+
+    @reconnect
+    def append_messages(self, user_identifier, project_id, messages):
+        cursor = self.get_cursor()
+        self.migrate_history(cursor, user_identifier, project_id)
+        self.insert_messages(cursor, user_identifier, project_id, messages)
+        cursor.connection.commit()
+
+    def insert_messages(self, cursor, user_identifier, project_id, messages):
+        # the messages are not compressed, postgres compresses large jsonb values itself
+        cursor.executemany("""
+            INSERT INTO message (user_identifier, project_id, message) VALUES (%s, %s, %s);
+        """, [(user_identifier, project_id, encode_message(message)) for message in messages])
+        cursor.execute("""
+            INSERT INTO history (user_identifier, project_id) VALUES (%s, %s)
             ON CONFLICT (user_identifier, project_id) DO UPDATE SET
-                messages = EXCLUDED.messages,
                 updated = CURRENT_TIMESTAMP;
-        """, (user_identifier, project_id, json.dumps(messages_to_dicts(messages))))
-        self.connection.commit()
+        """, (user_identifier, project_id))
+
+    def migrate_history(self, cursor, user_identifier, project_id):
+        # move the messages of histories stored by earlier versions to the message table
+        cursor.execute("""
+            SELECT messages FROM history WHERE user_identifier = %s AND project_id = %s AND messages IS NOT NULL;
+        """, (user_identifier, project_id))
+        result = cursor.fetchone()
+        if not result:
+            return False
+
+        cursor.execute("""
+            UPDATE history SET messages = NULL WHERE user_identifier = %s AND project_id = %s;
+        """, (user_identifier, project_id))
+        self.insert_messages(cursor, user_identifier, project_id, dicts_to_messages(result[0]))
+        cursor.connection.commit()
+        return True
+
+    @reconnect
+    def purge_expired(self, ttl, batch_size=1000):
+        # removes one batch of histories which were not updated within the ttl, returns the number of histories
+        cursor = self.get_cursor()
+        cursor.execute("""
+            SELECT user_identifier, project_id FROM history
+            WHERE updated < CURRENT_TIMESTAMP - make_interval(secs => %s) ORDER BY updated LIMIT %s;
+        """, (ttl, batch_size))
+        rows = cursor.fetchall()
+
+        # the expiry is checked again, in case a history was updated after it was selected,
+        # the messages and the summary are only removed together with their history
+        count = 0
+        for user_identifier, project_id in rows:
+            cursor.execute("""
+                DELETE FROM history WHERE user_identifier = %s AND project_id = %s
+                AND updated < CURRENT_TIMESTAMP - make_interval(secs => %s);
+            """, (user_identifier, project_id, ttl))
+            if cursor.rowcount:
+                cursor.execute("""
+                    DELETE FROM message WHERE user_identifier = %s AND project_id = %s;
+                """, (user_identifier, project_id))
+                cursor.execute("""
+                    DELETE FROM summary WHERE user_identifier = %s AND project_id = %s;
+                """, (user_identifier, project_id))
+                count += 1
+        cursor.connection.commit()
+        return count
 
+    @reconnect
     def reset_history(self, user_identifier, project_id):
-        self.cursor.execute("""
+        cursor = self.get_cursor()
+        cursor.execute("""
             DELETE FROM history WHERE user_identifier = %s AND project_id = %s;
         """, (user_identifier, project_id))
-        self.connection.commit()
+        cursor.execute("""
+            DELETE FROM message WHERE user_identifier = %s AND project_id = %s;
+        """, (user_identifier, project_id))
+        cursor.execute("""
+            DELETE FROM summary WHERE user_identifier = %s AND project_id = %s;
+        """, (user_identifier, project_id))
+        cursor.connection.commit()
+
+    @reconnect
+    def get_summary(self, user_identifier, project_id):
+        cursor = self.get_cursor()
+        cursor.execute("""
+            SELECT summary, message_count FROM summary WHERE user_identifier = %s AND project_id = %s;
+        """, (user_identifier, project_id))
+        result = cursor.fetchone()
+        cursor.connection.commit()
+        return tuple(result) if result else None
+
+    @reconnect
+    def set_summary(self, user_identifier, project_id, summary, count):
+        cursor = self.get_cursor()
+        cursor.execute("""
+            INSERT INTO summary (user_identifier, project_id, summary, message_count) VALUES (%s, %s, %s, %s)
+            ON CONFLICT (user_identifier, project_id) DO UPDATE SET
+                summary = EXCLUDED.summary,
+                message_count = EXCLUDED.message_count,
+                updated = CURRENT_TIMESTAMP;
+        """, (user_identifier, project_id, summary, count))
+        cursor.connection.commit()
+
+
+class AsyncPostgresStore(AsyncBaseStore):
+    def __init__(self):
+        connection_kwargs, pool_size = get_connection_kwargs(config.STORE_CONNECTION)
+        self.pool = AsyncConnectionPool(kwargs=connection_kwargs, max_size=pool_size, open=False,
+                                        check=AsyncConnectionPool.check_connection)
+        self.opened = False
+        self.lock = asyncio.Lock()
+
+    async def get_pool(self):
+        # the pool is opened lazily, since it needs to be awaited
+        if not self.opened:
+            async with self.lock:
+                if not self.opened:
+                    await self.pool.open()
+                    await self.create_table()
+                    self.opened = True
+        return self.pool
+
+    async def create_table(self):
+        async with self.pool.connection() as connection, connection.cursor() as cursor:
+            await cursor.execute("""
+                CREATE TABLE IF NOT EXISTS history (
+                    id INT GENERATED ALWAYS AS IDENTITY PRIMARY KEY,
+                    user_identifier VARCHAR(150),
+                    project_id INT,
+                    messages JSONB,
+                    created TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    UNIQUE (user_identifier, project_id)
+                );
+            """)
+            await cursor.execute("""
+                CREATE TABLE IF NOT EXISTS message (
+                    id INT GENERATED ALWAYS AS IDENTITY PRIMARY KEY,
+                    user_identifier VARCHAR(150),
+                    project_id INT,
+                    message JSONB,
+                    created TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                );
+            """)
+            await cursor.execute("""
+                CREATE INDEX IF NOT EXISTS message_user_project ON message (user_identifier, project_id, id);
+            """)
+            await cursor.execute("""
+                CREATE INDEX IF NOT EXISTS history_updated ON history (updated);
+            """)
+            await cursor.execute("""
+                CREATE TABLE IF NOT EXISTS summary (
+                    id INT GENERATED ALWAYS AS IDENTITY PRIMARY KEY,
+                    user_identifier VARCHAR(150),
+                    project_id INT,
+                    summary TEXT,
+                    message_count INTEGER,
+                    created TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    UNIQUE (user_identifier, project_id)
+                );
+            """)
+
+    # the connections of the pool commit at the end of each "async with" block
+
+    async def has_history(self, user_identifier, project_id):
+        pool = await self.get_pool()
+        async with pool.connection() as connection, connection.cursor() as cursor:
+            await cursor.execute("""
+                SELECT count(*) FROM history WHERE user_identifier = %s AND project_id = %s;
+            """, (user_identifier, project_id))
+            result = await cursor.fetchone()
+        return result[0] > 0 if result else False
+
+    async def get_history(self, user_identifier, project_id, limit=None, before=None):
+        sql = """
+            SELECT id, message FROM message WHERE user_identifier = %s AND project_id = %s
+        """
+        params = [user_identifier, project_id]
+        if before is not None:
+            sql += " AND id < %s"
+            params.append(int(before))
+        sql += " ORDER BY id DESC"
+        if limit is not None:
+            sql += " LIMIT %s"
+            params.append(limit)
+
+        pool = await self.get_pool()
+        async with pool.connection() as connection, connection.cursor() as cursor:
+            await cursor.execute(sql, params)
+            rows = await cursor.fetchall()
+
+            migrated = not rows and before is None and await self.migrate_history(cursor, user_identifier, project_id)
+
+        if migrated:
+            return await self.get_history(user_identifier, project_id, limit, before)
+
+        return decode_messages(rows[::-1])
+
+    async def set_history(self, user_identifier, project_id, messages):
+        pool = await self.get_pool()
+        async with pool.connection() as connection, connection.cursor() as cursor:
+            await cursor.execute("""
+                DELETE FROM message WHERE user_identifier = %s AND project_id = %s;
+            """, (user_identifier, project_id))
+            await cursor.execute("""
+                UPDATE history SET messages = NULL WHERE user_identifier = %s AND project_id = %s;
+            """, (user_identifier, project_id))
+            await self.insert_messages(cursor, user_identifier, project_id, messages)
+
+    async def append_messages(self, user_identifier, project_id, messages):
+        pool = await self.get_pool()
+        async with pool.connection() as connection, connection.cursor() as cursor:
+            await self.migrate_history(cursor, user_identifier, project_id)
+            await self.insert_messages(cursor, user_identifier, project_id, messages)
+
+    async def insert_messages(self, cursor, user_identifier, project_id, messages):
+        await cursor.executemany("""
+            INSERT INTO message (user_identifier, project_id, message) VALUES (%s, %s, %s);
+        """, [(user_identifier, project_id, encode_message(message)) for message in messages])
+        await cursor.execute("""
+            INSERT INTO history (user_identifier, project_id) VALUES (%s, %s)
+            ON CONFLICT (user_identifier, project_id) DO UPDATE SET
+                updated = CURRENT_TIMESTAMP;
+        """, (user_identifier, project_id))
+
+    async def migrate_history(self, cursor, user_identifier, project_id):
+        # move the messages of histories stored by earlier versions to the message table
+        await cursor.execute("""
+            SELECT messages FROM history WHERE user_identifier = %s AND project_id = %s AND messages IS NOT NULL;
+        """, (user_identifier, project_id))
+        result = await cursor.fetchone()
+        if not result:
+            return False
+
+        await cursor.execute("""
+            UPDATE history SET messages = NULL WHERE user_identifier = %s AND project_id = %s;
+        """, (user_identifier, project_id))
+        await self.insert_messages(cursor, user_identifier, project_id, dicts_to_messages(result[0]))
+        await cursor.connection.commit()
+        return True
+
+    async def purge_expired(self, ttl, batch_size=1000):
+        pool = await self.get_pool()
+        async with pool.connection() as connection, connection.cursor() as cursor:
+            await cursor.execute("""
+                SELECT user_identifier, project_id FROM history
+                WHERE updated < CURRENT_TIMESTAMP - make_interval(secs => %s) ORDER BY updated LIMIT %s;
+            """, (ttl, batch_size))
+            rows = await cursor.fetchall()
+
+            # the expiry is checked again, in case a history was updated after it was selected,
+            # the messages and the summary are only removed together with their history
+            count = 0
+            for user_identifier, project_id in rows:
+                await cursor.execute("""
+                    DELETE FROM history WHERE user_identifier = %s AND project_id = %s
+                    AND updated < CURRENT_TIMESTAMP - make_interval(secs => %s);
+                """, (user_identifier, project_id, ttl))
+                if cursor.rowcount:
+                    await cursor.execute("""
+                        DELETE FROM message WHERE user_identifier = %s AND project_id = %s;
+                    """, (user_identifier, project_id))
+                    await cursor.execute("""
+                        DELETE FROM summary WHERE user_identifier = %s AND project_id = %s;
+                    """, (user_identifier, project_id))
+                    count += 1
+        return count
+
+    async def reset_history(self, user_identifier, project_id):
+        pool = await self.get_pool()
+        async with pool.connection() as connection, connection.cursor() as cursor:
+            await cursor.execute("""
+                DELETE FROM history WHERE user_identifier = %s AND project_id = %s;
+            """, (user_identifier, project_id))
+            await cursor.execute("""
+                DELETE FROM message WHERE user_identifier = %s AND project_id = %s;
+            """, (user_identifier, project_id))
+            await cursor.execute("""
+                DELETE FROM summary WHERE user_identifier = %s AND project_id = %s;
+            """, (user_identifier, project_id))
+
+    async def get_summary(self, user_identifier, project_id):
+        pool = await self.get_pool()
+        async with pool.connection() as connection, connection.cursor() as cursor:
+            await cursor.execute("""
+                SELECT summary, message_count FROM summary WHERE user_identifier = %s AND project_id = %s;
+            """, (user_identifier, project_id))
+            result = await cursor.fetchone()
+        return tuple(result) if result else None
+
+    async def set_summary(self, user_identifier, project_id, summary, count):
+        pool = await self.get_pool()
+        async with pool.connection() as connection, connection.cursor() as cursor:
+            await cursor.execute("""
+                INSERT INTO summary (user_identifier, project_id, summary, message_count) VALUES (%s, %s, %s, %s)
+                ON CONFLICT (user_identifier, project_id) DO UPDATE SET
+                    summary = EXCLUDED.summary,
+                    message_count = EXCLUDED.message_count,
+                    updated = CURRENT_TIMESTAMP;
+            """, (user_identifier, project_id, summary, count))
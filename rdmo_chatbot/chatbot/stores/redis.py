@@ -1,32 +1,197 @@
 import json
 
 import redis
+import redis.asyncio
 
-from ..utils import dicts_to_messages, get_config, messages_to_dicts
-from . import BaseStore
+from ..utils import decode_messages, dicts_to_messages, encode_message, get_config
+from . import AsyncBaseStore, BaseStore, get_connection_kwargs
 
 config = get_config()
 
+# appends the messages in ARGV[2:] to the list in KEYS[1] and sets the ttl in ARGV[1] in one round-trip,
+# returns -1 if a history of an earlier version (KEYS[2]) needs to be migrated first
+APPEND_SCRIPT = """
+if redis.call("EXISTS", KEYS[2]) == 1 then
+    return -1
+end
+for i = 2, #ARGV do
+    redis.call("RPUSH", KEYS[1], ARGV[i])
+end
+if tonumber(ARGV[1]) > 0 then
+    redis.call("EXPIRE", KEYS[1], ARGV[1])
+end
+return redis.call("LLEN", KEYS[1])
+"""
+
 
 class RedisStore(BaseStore):
     def __init__(self):
-        self.redis_client = redis.Redis(**config.STORE_CONNECTION)
+        # the client is shared by the threads of the wrapper, each thread uses its own connection from the pool
+        connection_kwargs, self.max_workers = get_connection_kwargs(config.STORE_CONNECTION)
+        self.redis_client = redis.Redis(max_connections=self.max_workers, **connection_kwargs)
+        self.append_script = self.redis_client.register_script(APPEND_SCRIPT)
+        self.compression = getattr(config, "STORE_COMPRESSION", None)
 
     def has_history(self, user_identifier, project_id):
-        key = f"history:{user_identifier}:{project_id}"
-        return self.redis_client.exists(key)
+        key = f"messages:{user_identifier}:{project_id}"
+        legacy_key = f"history:{user_identifier}:{project_id}"
+        return self.redis_client.exists(key, legacy_key) > 0
+
+    def get_history(self, user_identifier, project_id, limit=None, before=None):
+        key = f"messages:{user_identifier}:{project_id}"
+
+        # the messages are identified by their index in the list, the length of the
+        # list is fetched in the same round-trip if it is needed to compute the index
+        if before is not None:
+            end = int(before)
+            start = 0 if limit is None else max(end - limit, 0)
+            messages_json = self.redis_client.lrange(key, start, end - 1) if end > start else []
+        elif limit is not None:
+            end, messages_json = self.redis_client.pipeline().llen(key).lrange(key, -limit, -1).execute()
+            start = end - len(messages_json)
+        else:
+            start, messages_json = 0, self.redis_client.lrange(key, 0, -1)
+
+        if not messages_json and before is None and self.migrate_history(user_identifier, project_id):
+            return self.get_history(user_identifier, project_id, limit, before)
 
-    def get_history(self, user_identifier, project_id):
-        key = f"history:{user_identifier}:{project_id}"
-        history_json = self.redis_client.get(key)
-        return dicts_to_messages(json.loads(history_json)) if history_json else []
+        return decode_messages(enumerate(messages_json, start=start))
 
     def set_history(self, user_identifier, project_id, history):
-        key = f"history:{user_identifier}:{project_id}"
-        self.redis_client.set(key, json.dumps(messages_to_dicts(history)))
+        key = f"messages:{user_identifier}:{project_id}"
+        legacy_key = f"history:{user_identifier}:{project_id}"
+
+        pipeline = self.redis_client.pipeline()
+        pipeline.delete(key, legacy_key)
+        if history:
+            pipeline.rpush(key, *[encode_message(message, self.compression) for message in history])
+            if hasattr(config, "STORE_TTL"):
+                pipeline.expire(key, config.STORE_TTL)
+        pipeline.execute()
+
+    def append_messages(self, user_identifier, project_id, messages):
+        key = f"messages:{user_identifier}:{project_id}"
+        legacy_key = f"history:{user_identifier}:{project_id}"
+        args = [getattr(config, "STORE_TTL", 0), *[encode_message(message, self.compression) for message in messages]]
+
+        if self.append_script(keys=[key, legacy_key], args=args) < 0:
+            self.migrate_history(user_identifier, project_id)
+            self.append_script(keys=[key, legacy_key], args=args)
+
+    def migrate_history(self, user_identifier, project_id):
+        # move the messages of histories stored by earlier versions to a list
+        key = f"messages:{user_identifier}:{project_id}"
+        legacy_key = f"history:{user_identifier}:{project_id}"
+        history_json, _ = self.redis_client.pipeline().get(legacy_key).delete(legacy_key).execute()
+        history = dicts_to_messages(json.loads(history_json)) if history_json else []
+        if not history:
+            return False
+
+        # the migrated history expires like a history which was stored by this version
+        pipeline = self.redis_client.pipeline()
+        pipeline.rpush(key, *[encode_message(message, self.compression) for message in history])
         if hasattr(config, "STORE_TTL"):
-            self.redis_client.expire(key, config.STORE_TTL)
+            pipeline.expire(key, config.STORE_TTL)
+        pipeline.execute()
+        return True
 
     def reset_history(self, user_identifier, project_id):
-        key = f"history:{user_identifier}:{project_id}"
-        self.redis_client.delete(key)
+        key = f"messages:{user_identifier}:{project_id}"
+        legacy_key = f"history:{user_identifier}:{project_id}"
+        summary_key = f"summary:{user_identifier}:{project_id}"
+        self.redis_client.delete(key, legacy_key, summary_key)
+
+    def get_summary(self, user_identifier, project_id):
+        key = f"summary:{user_identifier}:{project_id}"
+        summary_json = self.redis_client.get(key)
+        return tuple(json.loads(summary_json)) if summary_json else None
+
+    def set_summary(self, user_identifier, project_id, summary, count):
+        key = f"summary:{user_identifier}:{project_id}"
+        self.redis_client.set(key, json.dumps([summary, count]), ex=getattr(config, "STORE_TTL", None))
+
+
+class AsyncRedisStore(AsyncBaseStore):
+    def __init__(self):
+        connection_kwargs, pool_size = get_connection_kwargs(config.STORE_CONNECTION)
+        self.redis_client = redis.asyncio.Redis(max_connections=pool_size, **connection_kwargs)
+        self.append_script = self.redis_client.register_script(APPEND_SCRIPT)
+        self.compression = getattr(config, "STORE_COMPRESSION", None)
+
+    async def has_history(self, user_identifier, project_id):
+        key = f"messages:{user_identifier}:{project_id}"
+        legacy_key = f"history:{user_identifier}:{project_id}"
+        return await self.redis_client.exists(key, legacy_key) > 0
+
+    async def get_history(self, user_identifier, project_id, limit=None, before=None):
+        key = f"messages:{user_identifier}:{project_id}"
+
+        # the messages are identified by their index in the list, the length of the
+        # list is fetched in the same round-trip if it is needed to compute the index
+        if before is not None:
+            end = int(before)
+            start = 0 if limit is None else max(end - limit, 0)
+            messages_json = await self.redis_client.lrange(key, start, end - 1) if end > start else []
+        elif limit is not None:
+            end, messages_json = await self.redis_client.pipeline().llen(key).lrange(key, -limit, -1).execute()
+            start = end - len(messages_json)
+        else:
+            start, messages_json = 0, await self.redis_client.lrange(key, 0, -1)
+
+        if not messages_json and before is None and await self.migrate_history(user_identifier, project_id):
+            return await self.get_history(user_identifier, project_id, limit, before)
+
+        return decode_messages(enumerate(messages_json, start=start))
+
+    async def set_history(self, user_identifier, project_id, history):
+        key = f"messages:{user_identifier}:{project_id}"
+        legacy_key = f"history:{user_identifier}:{project_id}"
+
+        pipeline = self.redis_client.pipeline()
+        pipeline.delete(key, legacy_key)
+        if history:
+            pipeline.rpush(key, *[encode_message(message, self.compression) for message in history])
+            if hasattr(config, "STORE_TTL"):
+                pipeline.expire(key, config.STORE_TTL)
+        await pipeline.execute()
+
+    async def append_messages(self, user_identifier, project_id, messages):
+        key = f"messages:{user_identifier}:{project_id}"
+        legacy_key = f"history:{user_identifier}:{project_id}"
+        args = [getattr(config, "STORE_TTL", 0), *[encode_message(message, self.compression) for message in messages]]
+
+        if await self.append_script(keys=[key, legacy_key], args=args) < 0:
+            await self.migrate_history(user_identifier, project_id)
+            await self.append_script(keys=[key, legacy_key], args=args)
+
+    async def migrate_history(self, user_identifier, project_id):
+        # move the messages of histories stored by earlier versions to a list
+        key = f"messages:{user_identifier}:{project_id}"
+        legacy_key = f"history:{user_identifier}:{project_id}"
+        history_json, _ = await self.redis_client.pipeline().get(legacy_key).delete(legacy_key).execute()
+        history = dicts_to_messages(json.loads(history_json)) if history_json else []
+        if not history:
+            return False
+
+        # the migrated history expires like a history which was stored by this version
+        pipeline = self.redis_client.pipeline()
+        pipeline.rpush(key, *[encode_message(message, self.compression) for message in history])
+        if hasattr(config, "STORE_TTL"):
+            pipeline.expire(key, config.STORE_TTL)
+        await pipeline.execute()
+        return True
+
+    async def reset_history(self, user_identifier, project_id):
+        key = f"messages:{user_identifier}:{project_id}"
+        legacy_key = f"history:{user_identifier}:{project_id}"
+        summary_key = f"summary:{user_identifier}:{project_id}"
+        await self.redis_client.delete(key, legacy_key, summary_key)
+
+    async def get_summary(self, user_identifier, project_id):
+        key = f"summary:{user_identifier}:{project_id}"
+        summary_json = await self.redis_client.get(key)
+        return tuple(json.loads(summary_json)) if summary_json else None
+
+    async def set_summary(self, user_identifier, project_id, summary, count):
+        key = f"summary:{user_identifier}:{project_id}"
+        await self.redis_client.set(key, json.dumps([summary, count]), ex=getattr(config, "STORE_TTL", None))
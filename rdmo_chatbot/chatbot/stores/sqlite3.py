@@ -1,21 +1,44 @@
 import json
 import sqlite3
 
-from ..utils import dicts_to_messages, get_config, messages_to_dicts
-from . import BaseStore
+from ..utils import decode_messages, dicts_to_messages, encode_message, get_config
+from . import BaseStore, ThreadLocalConnection, get_connection_kwargs, reconnect
 
 config = get_config()
 
 
 class Sqlite3Store(BaseStore):
 
+    # a closed connection raises a ProgrammingError
+    connection_errors = (sqlite3.OperationalError, sqlite3.ProgrammingError)
+
     def __init__(self):
-        self.connection = sqlite3.connect(config.STORE_CONNECTION)
-        self.cursor = self.connection.cursor()
+        # the connection can be given as path or as dict, e.g. {"database": path, "pool_size": 4}
+        if isinstance(config.STORE_CONNECTION, dict):
+            self.connection_kwargs, self.max_workers = get_connection_kwargs(config.STORE_CONNECTION)
+        else:
+            self.connection_kwargs, self.max_workers = {"database": config.STORE_CONNECTION}, 4
+
+        # large messages can be compressed, since sqlite stores them as blobs
+        self.compression = getattr(config, "STORE_COMPRESSION", None)
+
+        self.connection = ThreadLocalConnection(self.connect)
         self.create_table()
+        # the tables are created in the main thread, whose connection is not used afterwards
+        self.connection.reset()
+
+    def connect(self):
+        connection = sqlite3.connect(**self.connection_kwargs)
+        # the write-ahead log allows reads from other threads while writing
+        connection.execute("PRAGMA journal_mode=WAL;")
+        return connection
+
+    def get_cursor(self):
+        return self.connection.get().cursor()
 
     def create_table(self):
-        self.cursor.execute("""
+        cursor = self.get_cursor()
+        cursor.execute("""
             CREATE TABLE IF NOT EXISTS history (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 user_identifier TEXT,
@@ -26,35 +49,171 @@ class Sqlite3Store(BaseStore):
                 UNIQUE(user_identifier, project_id)
             );
         """)
-        self.connection.commit()
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS message (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_identifier TEXT,
+                project_id INTEGER,
+                message JSON,
+                created TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            );
+        """)
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS message_user_project ON message (user_identifier, project_id, id);
+        """)
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS history_updated ON history (updated);
+        """)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS summary (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_identifier TEXT,
+                project_id INTEGER,
+                summary TEXT,
+                message_count INTEGER,
+                created TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                UNIQUE(user_identifier, project_id)
+            );
+        """)
+        cursor.connection.commit()
 
+    @reconnect
     def has_history(self, user_identifier, project_id):
-        self.cursor.execute("""
+        cursor = self.get_cursor()
+        cursor.execute("""
             SELECT count(*) FROM history WHERE user_identifier = ? AND project_id = ?;
         """, (user_identifier, project_id))
-        result = self.cursor.fetchone()
+        result = cursor.fetchone()
         return result[0] > 0 if result else False
 
-    def get_history(self, user_identifier, project_id):
-        self.cursor.execute("""
-            SELECT messages FROM history WHERE user_identifier = ? AND project_id = ?;
-        """, (user_identifier, project_id))
-        result = self.cursor.fetchone()
-        if not result or result[0] is None:
-            return []
-        return dicts_to_messages(json.loads(result[0]))
+    @reconnect
+    def get_history(self, user_identifier, project_id, limit=None, before=None):
+        cursor = self.get_cursor()
+        sql = """
+            SELECT id, message FROM message WHERE user_identifier = ? AND project_id = ?
+        """
+        params = [user_identifier, project_id]
+        if before is not None:
+            sql += " AND id < ?"
+            params.append(int(before))
+        sql += " ORDER BY id DESC"
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
 
+        cursor.execute(sql, params)
+        rows = cursor.fetchall()
+
+        if not rows and before is None and self.migrate_history(cursor, user_identifier, project_id):
+            return self.get_history(user_identifier, project_id, limit, before)
+
+        return decode_messages(rows[::-1])
+
+    @reconnect
     def set_history(self, user_identifier, project_id, messages):
-        self.cursor.execute("""
-            INSERT INTO history (user_identifier, project_id, messages) VALUES (?, ?, ?)
+        cursor = self.get_cursor()
+        cursor.execute("""
+            DELETE FROM message WHERE user_identifier = ? AND project_id = ?;
+        """, (user_identifier, project_id))
+        cursor.execute("""
+            UPDATE history SET messages = NULL WHERE user_identifier = ? AND project_id = ?;
+        """, (user_identifier, project_id))
+        self.insert_messages(cursor, user_identifier, project_id, messages)
+        cursor.connection.commit()
+
+    @reconnect
+    def append_messages(self, user_identifier, project_id, messages):
+        cursor = self.get_cursor()
+        self.migrate_history(cursor, user_identifier, project_id)
+        self.insert_messages(cursor, user_identifier, project_id, messages)
+        cursor.connection.commit()
+
+    def insert_messages(self, cursor, user_identifier, project_id, messages):
+        cursor.executemany("""
+            INSERT INTO message (user_identifier, project_id, message) VALUES (?, ?, ?);
+        """, [(user_identifier, project_id, encode_message(message, self.compression)) for message in messages])
+        cursor.execute("""
+            INSERT INTO history (user_identifier, project_id) VALUES (?, ?)
             ON CONFLICT (user_identifier, project_id) DO UPDATE SET
-                messages = EXCLUDED.messages,
                 updated = CURRENT_TIMESTAMP;
-        """, (user_identifier, project_id, json.dumps(messages_to_dicts(messages))))
-        self.connection.commit()
+        """, (user_identifier, project_id))
 
+    def migrate_history(self, cursor, user_identifier, project_id):
+        # move the messages of histories stored by earlier versions to the message table
+        cursor.execute("""
+            SELECT messages FROM history WHERE user_identifier = ? AND project_id = ? AND messages IS NOT NULL;
+        """, (user_identifier, project_id))
+        result = cursor.fetchone()
+        if not result:
+            return False
+
+        cursor.execute("""
+            UPDATE history SET messages = NULL WHERE user_identifier = ? AND project_id = ?;
+        """, (user_identifier, project_id))
+        self.insert_messages(cursor, user_identifier, project_id, dicts_to_messages(json.loads(result[0])))
+        cursor.connection.commit()
+        return True
+
+    @reconnect
+    def purge_expired(self, ttl, batch_size=1000):
+        # removes one batch of histories which were not updated within the ttl, returns the number of histories
+        cursor = self.get_cursor()
+        cursor.execute("""
+            SELECT user_identifier, project_id FROM history WHERE updated < datetime('now', ?) ORDER BY updated LIMIT ?;
+        """, (f"-{int(ttl)} seconds", batch_size))
+        rows = cursor.fetchall()
+
+        # the expiry is checked again, in case a history was updated after it was selected,
+        # the messages and the summary are only removed together with their history
+        count = 0
+        for user_identifier, project_id in rows:
+            cursor.execute("""
+                DELETE FROM history
+                WHERE user_identifier = ? AND project_id = ? AND updated < datetime('now', ?);
+            """, (user_identifier, project_id, f"-{int(ttl)} seconds"))
+            if cursor.rowcount:
+                cursor.execute("""
+                    DELETE FROM message WHERE user_identifier = ? AND project_id = ?;
+                """, (user_identifier, project_id))
+                cursor.execute("""
+                    DELETE FROM summary WHERE user_identifier = ? AND project_id = ?;
+                """, (user_identifier, project_id))
+                count += 1
+        cursor.connection.commit()
+        return count
+
+    @reconnect
     def reset_history(self, user_identifier, project_id):
-        self.cursor.execute("""
+        cursor = self.get_cursor()
+        cursor.execute("""
             DELETE FROM history WHERE user_identifier = ? AND project_id = ?;
         """, (user_identifier, project_id))
-        self.connection.commit()
+        cursor.execute("""
+            DELETE FROM message WHERE user_identifier = ? AND project_id = ?;
+        """, (user_identifier, project_id))
+        cursor.execute("""
+            DELETE FROM summary WHERE user_identifier = ? AND project_id = ?;
+        """, (user_identifier, project_id))
+        cursor.connection.commit()
+
+    @reconnect
+    def get_summary(self, user_identifier, project_id):
+        cursor = self.get_cursor()
+        cursor.execute("""
+            SELECT summary, message_count FROM summary WHERE user_identifier = ? AND project_id = ?;
+        """, (user_identifier, project_id))
+        result = cursor.fetchone()
+        return tuple(result) if result else None
+
+    @reconnect
+    def set_summary(self, user_identifier, project_id, summary, count):
+        cursor = self.get_cursor()
+        cursor.execute("""
+            INSERT INTO summary (user_identifier, project_id, summary, message_count) VALUES (?, ?, ?, ?)
+            ON CONFLICT (user_identifier, project_id) DO UPDATE SET
+                summary = EXCLUDED.summary,
+                message_count = EXCLUDED.message_count,
+                updated = CURRENT_TIMESTAMP;
+        """, (user_identifier, project_id, summary, count))
+        cursor.connection.commit()
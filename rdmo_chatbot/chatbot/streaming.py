@@ -0,0 +1,67 @@
+import asyncio
+import time
+
+from metrics import counter
+from utils import get_config
+
+config = get_config()
+
+tokens_total = counter("chatbot_stream_tokens_total", "Tokens received from the LLM while streaming.")
+emits_total = counter("chatbot_stream_emits_total", "Streamed tokens emitted to the client.")
+
+# the tokens are coalesced for 40 ms by default, which is not noticeable when reading, 0 sends every token at once
+FLUSH_INTERVAL = 0.04
+
+
+class StreamBuffer:
+    # coalesces the tokens of a streamed response, the buffer is sent to the client when the flush interval
+    # (in seconds) has passed since the first buffered token or when the buffer exceeds the flush size
+
+    def __init__(self, message, interval=None, size=None):
+        self.message = message
+        self.interval = getattr(config, "STREAM_FLUSH_INTERVAL", FLUSH_INTERVAL) if interval is None else interval
+        self.size = getattr(config, "STREAM_FLUSH_SIZE", None) if size is None else size
+        self.buffer = []
+        self.length = 0
+        self.lock = asyncio.Lock()
+        self.task = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        if self.task is not None:
+            self.task.cancel()
+        await self.flush()
+
+    async def write(self, token):
+        if not token:
+            return
+
+        tokens_total.inc()
+        self.buffer.append(token)
+        self.length += len(token)
+
+        if not self.interval or (self.size and self.length >= self.size):
+            await self.flush()
+        elif self.task is None:
+            self.task = asyncio.create_task(self.flush_later(time.monotonic() + self.interval))
+
+    async def flush_later(self, deadline):
+        await asyncio.sleep(max(0, deadline - time.monotonic()))
+        self.task = None
+        await self.flush()
+
+    async def flush(self):
+        if self.task is not None and self.task is not asyncio.current_task():
+            self.task.cancel()
+            self.task = None
+
+        # the lock keeps the order of the tokens, if the timer and a write flush at the same time
+        async with self.lock:
+            if self.buffer:
+                token = "".join(self.buffer)
+                self.buffer.clear()
+                self.length = 0
+                emits_total.inc()
+                await self.message.stream_token(token)
@@ -1,7 +1,11 @@
 import base64
 import importlib
+import inspect
 import json
 import os
+import time
+import zlib
+from functools import lru_cache
 from http.cookies import SimpleCookie
 from types import SimpleNamespace
 
@@ -9,23 +13,84 @@ import chainlit as cl
 import jwt
 from langchain_core.messages import AIMessage, HumanMessage
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
+# the version of the compact format of the stored messages
+MESSAGE_FORMAT_VERSION = 1
+
+# messages which are shorter are not compressed
+COMPRESSION_MIN_SIZE = 1024
+
+# the first byte of compressed messages, json starts with "{"
+COMPRESSION_MARKERS = {"zlib": b"Z", "zstd": b"S"}
+
+MESSAGE_CLASSES = {"human": HumanMessage, "ai": AIMessage}
+
+
+@lru_cache(maxsize=1)
 def get_config():
+    # the config is parsed once, instead of once for every module which imports it
     return SimpleNamespace(**json.loads(os.getenv("CHATBOT_CONFIG")))
 
 
 def get_store(config):
+    from instrumentation import InstrumentedStore, collect_store_stats
+
+    from rdmo_chatbot.chatbot.stores import AsyncStoreWrapper
+
     store_module_name, store_class_name = config.STORE.rsplit(".", 1)
     store_module = importlib.import_module(store_module_name)
     store_class = getattr(store_module, store_class_name)
-    return store_class()
+    store = store_class()
+
+    if hasattr(store, "get_stats"):
+        collect_store_stats(store)
+
+    # synchronous stores are wrapped, so that the adapter can always await the store
+    if not inspect.iscoroutinefunction(store.get_history):
+        store = AsyncStoreWrapper(store)
+
+    return InstrumentedStore(store)
+
+
+def get_response_cache(config):
+    from rdmo_chatbot.chatbot.caches import AsyncCacheWrapper
+
+    cache = getattr(config, "RESPONSE_CACHE", None)
+    if not cache:
+        return None
+
+    cache_module_name, cache_class_name = cache.rsplit(".", 1)
+    cache_module = importlib.import_module(cache_module_name)
+    cache_class = getattr(cache_module, cache_class_name)
+    return AsyncCacheWrapper(cache_class())
+
+
+def get_semantic_cache(config):
+    if getattr(config, "RESPONSE_CACHE_SEMANTIC", False):
+        from rdmo_chatbot.chatbot.caches.semantic import SemanticCache
+        return SemanticCache()
 
 
 def get_adapter(config):
+    from instrumentation import InstrumentedAdapter
+
     adapter_module_name, adapter_class_name = config.ADAPTER.rsplit(".", 1)
     adapter_module = importlib.import_module(adapter_module_name)
     adapter_class = getattr(adapter_module, adapter_class_name)
-    return adapter_class()
+    return InstrumentedAdapter(adapter_class())
+
+
+@lru_cache(maxsize=1024)
+def decode_token(value, secret):
+    # the decoded tokens are cached, since the same token is sent with every websocket handshake
+    try:
+        return jwt.decode(value, secret, algorithms=["HS256"])
+    except jwt.exceptions.InvalidTokenError:
+        return None
 
 
 def get_user(config, headers):
@@ -36,12 +101,14 @@ def get_user(config, headers):
     if not cookie:
         return None
 
-    try:
-        token = jwt.decode(cookie.value, config.AUTH_SECRET, algorithms=["HS256"])
-        return cl.User(identifier=token["identifier"], metadata=token["metadata"], display_name=token["display_name"])
-    except jwt.exceptions.InvalidSignatureError:
+    token = decode_token(cookie.value, config.AUTH_SECRET)
+
+    # a cached token might have expired after it was decoded
+    if token is None or token.get("exp", float("inf")) < time.time():
         return None
 
+    return cl.User(identifier=token["identifier"], metadata=token["metadata"], display_name=token["display_name"])
+
 
 def parse_context(raw_context):
     return json.loads(base64.b64decode(raw_context).decode())
@@ -51,6 +118,78 @@ def messages_to_dicts(messages):
     return [message.dict() for message in messages]
 
 
+def dumps(data):
+    if orjson is not None:
+        return orjson.dumps(data).decode()
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+
+
+def loads(data):
+    return orjson.loads(data) if orjson is not None else json.loads(data)
+
+
+def message_to_dict(message):
+    # only the type, the content and non-empty metadata of the message are stored
+    data = {"v": MESSAGE_FORMAT_VERSION, "t": message.type, "c": message.content}
+    if message.additional_kwargs:
+        data["k"] = message.additional_kwargs
+    if message.name:
+        data["n"] = message.name
+    return data
+
+
+def dict_to_message(data, message_id=None):
+    if data.get("v") == MESSAGE_FORMAT_VERSION:
+        message_class = MESSAGE_CLASSES.get(data.get("t"))
+        kwargs = {"content": data.get("c", ""), "additional_kwargs": data.get("k", {}), "name": data.get("n")}
+    else:
+        # messages stored by earlier versions contain all fields of the message
+        message_class = MESSAGE_CLASSES.get(data.get("type"))
+        kwargs = data
+
+    if message_class is not None:
+        return message_class(**{**kwargs, "id": message_id})
+
+
+def encode_message(message, compression=None):
+    # returns a json string, or bytes if the message is large and compression is enabled
+    message_json = dumps(message_to_dict(message))
+    if compression is None or len(message_json) < COMPRESSION_MIN_SIZE:
+        return message_json
+
+    if compression == "zstd":
+        import zstandard
+        return COMPRESSION_MARKERS["zstd"] + zstandard.ZstdCompressor().compress(message_json.encode())
+    elif compression == "zlib":
+        return COMPRESSION_MARKERS["zlib"] + zlib.compress(message_json.encode())
+    else:
+        raise ValueError(f"Unknown compression {compression}, please use zlib or zstd.")
+
+
+def decode_message(data, message_id=None):
+    # data can be a json string, json bytes, compressed bytes, or a dict decoded by the database driver
+    if isinstance(data, memoryview):
+        data = data.tobytes()
+
+    if isinstance(data, bytes):
+        if data[:1] == COMPRESSION_MARKERS["zlib"]:
+            data = zlib.decompress(data[1:])
+        elif data[:1] == COMPRESSION_MARKERS["zstd"]:
+            import zstandard
+            data = zstandard.ZstdDecompressor().decompress(data[1:])
+
+    if not isinstance(data, dict):
+        data = loads(data)
+
+    return dict_to_message(data, message_id)
+
+
+def decode_messages(rows):
+    # rows are pairs of message id and data, messages of unknown types are skipped
+    messages = (decode_message(data, str(message_id)) for message_id, data in rows)
+    return [message for message in messages if message is not None]
+
+
 def dicts_to_messages(dicts):
     messages = []
     for message in dicts:
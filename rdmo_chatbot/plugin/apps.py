@@ -12,3 +12,5 @@ class ChatbotConfig(AppConfig):
             raise ImproperlyConfigured(
                 "rdmo_chatbot.plugin.middleware.ChatbotMiddleware must be added to settings.MIDDLEWARE"
             )
+
+        from . import signals  # noqa: F401
@@ -0,0 +1,69 @@
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.translation import get_language
+
+
+def get_cache():
+    return caches[getattr(settings, "CHATBOT_PROJECT_CACHE", "default")]
+
+
+def get_project_version_key(project_id):
+    return f"chatbot:project:{project_id}:version"
+
+
+def get_questions_version_key():
+    # catalogs, questions and options are shared by the projects, they use one common version
+    return "chatbot:questions:version"
+
+
+def get_project_answers_key(project_id, version, questions_version, lang_code):
+    # the exported answers contain the text of the questions in the current language
+    return f"chatbot:project:{project_id}:{version}:{questions_version}:{lang_code}:answers"
+
+
+def get_project_etag(project_id):
+    return f"{project_id}-{get_project_version(project_id)}-{get_questions_version()}-{get_language()}"
+
+
+def get_version(key):
+    # the version is initialized with the current time, so that a flushed cache
+    # does not hand out version numbers which were already used before
+    return get_cache().get_or_set(key, lambda: int(time.time() * 1000), timeout=None)
+
+
+def bump_version(key):
+    try:
+        return get_cache().incr(key)
+    except ValueError:
+        # the key is missing, initialize a new version
+        return get_version(key)
+
+
+def get_project_version(project_id):
+    return get_version(get_project_version_key(project_id))
+
+
+def bump_project_version(project_id):
+    return bump_version(get_project_version_key(project_id))
+
+
+def get_questions_version():
+    return get_version(get_questions_version_key())
+
+
+def bump_questions_version():
+    return bump_version(get_questions_version_key())
+
+
+def get_project_answers(project, build):
+    cache = get_cache()
+    key = get_project_answers_key(project.id, get_project_version(project.id), get_questions_version(), get_language())
+
+    answers = cache.get(key)
+    if answers is None:
+        answers = build(project)
+        cache.set(key, answers, timeout=getattr(settings, "CHATBOT_PROJECT_CACHE_TIMEOUT", 86400))
+
+    return answers
@@ -0,0 +1,734 @@
+import asyncio
+import importlib
+import json
+import subprocess
+import tempfile
+import time
+import uuid
+from datetime import datetime, timezone
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import CommandError
+
+from .runchatbot import Command as RunChatbotCommand
+
+STORES = {
+    "locmem": "rdmo_chatbot.chatbot.stores.locmem.LocMemStore",
+    "sqlite3": "rdmo_chatbot.chatbot.stores.sqlite3.Sqlite3Store",
+    "redis": "rdmo_chatbot.chatbot.stores.redis.RedisStore",
+}
+
+QUESTIONS = [
+    "Where should the data of the project be stored?",
+    "Which license should we use for the published data?",
+    "How can the metadata be documented?",
+    "What are the ethical aspects of the project?",
+    "How long should the data be kept after the project?",
+]
+
+# the time to wait for the chatbot server to start
+STARTUP_TIMEOUT = 60
+
+
+def percentile(values, percent):
+    if not values:
+        return float("nan")
+    values = sorted(values)
+    return values[min(len(values) - 1, max(0, round(percent / 100 * len(values)) - 1))]
+
+
+def get_rss(pid):
+    # the resident memory of a process in bytes, only available on linux
+    try:
+        with open(f"/proc/{pid}/status") as fp:
+            for line in fp:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        return None
+
+
+def get_project(project_id, size):
+    return {
+        "id": project_id,
+        "title": f"Benchmark project {project_id}",
+        "description": "A synthetic project for benchmarking the chatbot.",
+        "answers": [
+            {
+                "attribute": f"project/dataset/attribute-{index}",
+                "question": f"Question {index} about the data of the project?",
+                "answer": f"Answer {index}: " + " ".join(QUESTIONS[index % len(QUESTIONS)].split()[::-1]),
+                "set": index // 10,
+            } for index in range(size)
+        ]
+    }
+
+
+class Client:
+    # simulates the copilot in the browser, the functions of the copilot are answered with a synthetic project
+
+    def __init__(self, url, socketio_path, index, project_size):
+        import socketio
+
+        self.url = url
+        self.socketio_path = socketio_path
+        self.user_identifier = f"benchmark-{uuid.uuid4()}"
+        self.project = get_project(index + 1, project_size)
+        self.sio = socketio.AsyncClient(reconnection=False)
+        self.confirmed = False
+        self.started = asyncio.Event()
+        self.task_ended = asyncio.Event()
+        self.first_token = None
+        self.latencies = []
+        self.first_token_latencies = []
+        self.received = 0
+        self.turn_sizes = []
+        self.contact_sizes = []
+
+        self.sio.on("call_fn", self.on_call_fn)
+        self.sio.on("ask", self.on_ask)
+        self.sio.on("new_message", self.on_new_message)
+        self.sio.on("stream_token", self.on_stream_token)
+        self.sio.on("update_message", self.on_update_message)
+        self.sio.on("action", self.on_action)
+        self.sio.on("task_end", self.on_task_end)
+
+    async def on_call_fn(self, data):
+        name, args = data.get("name"), data.get("args") or {}
+        if name == "getProjectId":
+            return self.project["id"]
+        elif name == "getLangCode":
+            return "en"
+        elif name == "getProject":
+            if args.get("etag") == "benchmark":
+                return {"etag": "benchmark", "modified": False}
+            return {"etag": "benchmark", "modified": True, "project": self.project}
+
+    async def on_ask(self, data):
+        # confirm the start of the chat
+        self.confirmed = True
+        return {
+            "name": "confirmation",
+            "payload": {"value": "confirmation"},
+            "label": "",
+            "tooltip": "",
+            "forId": data["msg"]["id"],
+            "id": str(uuid.uuid4()),
+        }
+
+    async def on_new_message(self, data):
+        self.received += len(json.dumps(data))
+
+        # the chat has started once a message follows the confirmation
+        if self.confirmed:
+            self.started.set()
+
+    async def on_stream_token(self, data):
+        self.received += len(json.dumps(data))
+        if self.first_token is None:
+            self.first_token = time.monotonic()
+
+    async def on_update_message(self, data):
+        self.received += len(json.dumps(data))
+
+    async def on_action(self, data):
+        self.received += len(json.dumps(data))
+        if data.get("name") == "on_contact":
+            self.contact_sizes.append(len(json.dumps(data.get("payload"))))
+
+    async def on_task_end(self, data):
+        self.task_ended.set()
+
+    async def connect(self, token):
+        import httpx
+
+        async with httpx.AsyncClient(base_url=self.url) as client:
+            response = await client.post("/auth/header", cookies={"chatbot_token": token})
+            response.raise_for_status()
+            access_token = response.cookies.get("access_token")
+
+        await self.sio.connect(
+            self.url,
+            socketio_path=self.socketio_path,
+            transports=["websocket"],
+            headers={"Cookie": f"access_token={access_token}; chatbot_token={token}"},
+            auth={
+                "clientType": "copilot",
+                "sessionId": str(uuid.uuid4()),
+                "threadId": None,
+                "userEnv": "{}",
+                "chatProfile": None
+            },
+        )
+        await self.sio.emit("connection_successful")
+        await self.started.wait()
+
+    async def send(self, content):
+        self.task_ended.clear()
+        self.first_token = None
+        self.received = 0
+        started = time.monotonic()
+
+        await self.sio.emit("client_message", {
+            "message": {
+                "id": str(uuid.uuid4()),
+                "threadId": "",
+                "type": "user_message",
+                "name": "User",
+                "output": content,
+                "createdAt": datetime.now(timezone.utc).isoformat(),
+            },
+            "fileReferences": None
+        })
+        await self.task_ended.wait()
+
+        self.latencies.append(time.monotonic() - started)
+        self.turn_sizes.append(self.received)
+        if self.first_token is not None:
+            self.first_token_latencies.append(self.first_token - started)
+
+    async def disconnect(self):
+        await self.sio.disconnect()
+
+
+class Command(RunChatbotCommand):
+    help = "Runs the chatbot with a fake LLM and simulated copilot clients and reports the throughput."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--clients", type=int, default=10, help="Number of concurrent clients.")
+        parser.add_argument("--turns", type=int, default=5, help="Number of messages sent by each client.")
+        parser.add_argument("--answers", type=int, default=100, help="Number of answers in each project.")
+        parser.add_argument("--stores", default="locmem,sqlite3",
+                            help=f"Comma separated list of stores ({', '.join(STORES)}).")
+        parser.add_argument("--redis", default="127.0.0.1:6379", help="Host and port of the Redis server.")
+        parser.add_argument("--latency", type=float, default=0.5, help="Latency of the fake LLM in seconds.")
+        parser.add_argument("--token-rate", type=float, default=50, help="Tokens per second of the fake LLM.")
+        parser.add_argument("--response-tokens", type=int, default=100, help="Tokens in each response.")
+        parser.add_argument("--port", type=int, default=8090)
+        parser.add_argument("--chainlit-path", dest="chainlit-path", default="chainlit")
+        parser.add_argument("--middleware", action="store_true",
+                            help="Only measure the overhead of the chatbot middleware per request.")
+        parser.add_argument("--requests", type=int, default=10000,
+                            help="Number of requests for the middleware benchmark.")
+        parser.add_argument("--serialization", action="store_true",
+                            help="Only measure the size and the encoding time of a stored history.")
+        parser.add_argument("--messages", type=int, default=100,
+                            help="Number of messages in the history for the serialization benchmark.")
+        parser.add_argument("--semantic", action="store_true",
+                            help="Only measure the lookup time of the semantic cache.")
+        parser.add_argument("--entries", default="10000,100000",
+                            help="Comma separated numbers of cached questions for the semantic cache benchmark.")
+        parser.add_argument("--dimensions", type=int, default=768,
+                            help="Dimensions of the embeddings for the semantic cache benchmark.")
+        parser.add_argument("--streaming", action="store_true",
+                            help="Only measure the emits and the CPU time of concurrent streamed responses.")
+        parser.add_argument("--streams", type=int, default=100,
+                            help="Number of concurrent streams for the streaming benchmark.")
+        parser.add_argument("--store-load", dest="store_load", action="store_true",
+                            help="Only run a load test of the stores with 1, --clients and 10 times as many sessions.")
+        parser.add_argument("--round-trips", dest="round_trips", action="store_true",
+                            help="Only count the round-trips to Redis per chat turn, using fakeredis.")
+        parser.add_argument("--context", action="store_true",
+                            help="Only measure the size of the context for projects with --entries answers.")
+        parser.add_argument("--budget", type=int, default=getattr(settings, "CHATBOT_CONTEXT_TOKEN_BUDGET", 4000),
+                            help="Token budget for the context benchmark.")
+
+    def handle(self, *args, **options):
+        if options["middleware"]:
+            return self.benchmark_middleware(options["requests"])
+        if options["serialization"]:
+            return self.benchmark_serialization(options["messages"], options["response_tokens"])
+        if options["streaming"]:
+            return asyncio.run(self.benchmark_streaming(options["streams"], options["response_tokens"],
+                                                        options["token_rate"]))
+        if options["store_load"]:
+            return asyncio.run(self.benchmark_store_load([1, options["clients"], options["clients"] * 10],
+                                                         max(options["turns"], 20), options["redis"]))
+        if options["round_trips"]:
+            # the round-trips per turn should not depend on the length of the history
+            messages = options["messages"]
+            return asyncio.run(self.benchmark_round_trips([0, messages // 10, messages, messages * 10]))
+        if options["context"]:
+            return self.benchmark_context([int(entries) for entries in options["entries"].split(",")],
+                                          options["budget"])
+        if options["semantic"]:
+            return self.benchmark_semantic([int(entries) for entries in options["entries"].split(",")],
+                                           options["dimensions"], options["requests"])
+
+        chatbot_module = importlib.import_module("rdmo_chatbot.chatbot")
+        chatbot_path = chatbot_module.__path__[0]
+        chatbot_cwd = getattr(settings, "CHATBOT_PATH", None) or chatbot_path
+
+        if options["clients"] < 1 or options["turns"] < 1:
+            raise CommandError("Please use at least one client and one turn.")
+
+        results = []
+        for store in options["stores"].split(","):
+            if store not in STORES:
+                raise CommandError(f"Unknown store {store}, please use one of {', '.join(STORES)}.")
+
+            with tempfile.TemporaryDirectory() as tmp:
+                chatbot_config = self.get_benchmark_config(store, options, tmp)
+                chatbot_env = self.get_chatbot_env(chatbot_config)
+
+                self.stdout.write(f"Benchmarking {store} with {options['clients']} clients ...")
+                process = subprocess.Popen(
+                    self.get_chatbot_args({"chainlit-path": options["chainlit-path"], "host": "127.0.0.1"},
+                                          chatbot_path, options["port"]),
+                    cwd=chatbot_cwd,
+                    env=chatbot_env,
+                    stdout=subprocess.DEVNULL
+                )
+                try:
+                    results.append((store, asyncio.run(self.run_benchmark(process, chatbot_config, options))))
+                finally:
+                    process.terminate()
+                    process.wait()
+
+        self.stdout.write("")
+        self.stdout.write(f"{'store':10} {'turns/s':>8} {'p50':>8} {'p95':>8} {'p99':>8} "
+                          f"{'ttft p50':>9} {'MiB/session':>12} {'bytes/turn (first, last)':>25}")
+        for store, result in results:
+            memory = "n/a" if result["memory"] is None else f"{result['memory'] / 2 ** 20:.2f}"
+            self.stdout.write(
+                f"{store:10} {result['throughput']:8.2f} {result['p50']:7.2f}s {result['p95']:7.2f}s "
+                f"{result['p99']:7.2f}s {result['ttft']:8.2f}s {memory:>12} "
+                f"{result['first_turn_bytes']:>12.0f} {result['last_turn_bytes']:>12.0f}"
+            )
+
+        # the payload of a turn should not grow with the length of the conversation
+        for store, result in results:
+            if result["growing_contact_sizes"]:
+                self.stdout.write(f"The payload of the contact action grew for {len(result['growing_contact_sizes'])} "
+                                  f"clients ({store}), e.g. "
+                                  f"{', '.join(map(str, result['growing_contact_sizes'][0]))} bytes.")
+
+    def benchmark_middleware(self, count):
+        from django.contrib.auth import get_user_model
+        from django.http import HttpResponse
+        from django.test import RequestFactory, override_settings
+
+        from rdmo_chatbot.plugin.middleware import ChatbotMiddleware
+
+        # the user is not saved, the middleware only needs the username and the name
+        user = get_user_model()(username="benchmark", first_name="Bench", last_name="Mark")
+        middleware = ChatbotMiddleware(lambda request: HttpResponse())
+        factory = RequestFactory()
+
+        for reuse in [False, True]:
+            with override_settings(CHATBOT_TOKEN_REUSE=reuse):
+                # the cookie of the previous response is sent again, like a browser would
+                cookies, issued = {}, 0
+                started = time.perf_counter()
+                for _ in range(count):
+                    request = factory.get("/projects/", HTTP_COOKIE="; ".join(f"{k}={v}" for k, v in cookies.items()))
+                    request.user = user
+                    response = middleware(request)
+                    if "chatbot_token" in response.cookies:
+                        cookies["chatbot_token"] = response.cookies["chatbot_token"].value
+                        issued += 1
+                elapsed = time.perf_counter() - started
+
+            self.stdout.write(f"reuse={reuse!s:5} {elapsed / count * 1e6:8.1f} µs/request "
+                              f"{issued} tokens issued for {count} requests")
+
+    def benchmark_serialization(self, count, response_tokens, repeat=20):
+        import json
+        import random
+
+        from langchain_core.messages import AIMessage, HumanMessage
+
+        from rdmo_chatbot.chatbot.fake import WORDS
+        from rdmo_chatbot.chatbot.utils import decode_messages, dicts_to_messages, encode_message
+
+        rng = random.Random(0)
+        history = [
+            AIMessage(content=" ".join(rng.choices(WORDS, k=response_tokens)), response_metadata={"model": "fake"})
+            if index % 2 else HumanMessage(content=QUESTIONS[index // 2 % len(QUESTIONS)])
+            for index in range(count)
+        ]
+
+        def encode_legacy(messages):
+            return [json.dumps(message.dict()) for message in messages]
+
+        def decode_legacy(rows):
+            return dicts_to_messages([{**json.loads(data), "id": str(index)} for index, data in rows])
+
+        formats = [("legacy", encode_legacy, decode_legacy)]
+        for compression in [None, "zlib", "zstd"]:
+            formats.append((
+                f"compact ({compression})" if compression else "compact",
+                lambda messages, compression=compression: [encode_message(m, compression) for m in messages],
+                decode_messages
+            ))
+
+        self.stdout.write(f"{'format':18} {'bytes':>10} {'encode':>10} {'decode':>10}   ({count} messages)")
+        for name, encode, decode in formats:
+            try:
+                rows = encode(history)
+            except ImportError as e:
+                self.stdout.write(f"{name:18} skipped, {e}")
+                continue
+
+            started = time.perf_counter()
+            for _ in range(repeat):
+                rows = encode(history)
+            encode_time = (time.perf_counter() - started) / repeat
+
+            started = time.perf_counter()
+            for _ in range(repeat):
+                decode(list(enumerate(rows)))
+            decode_time = (time.perf_counter() - started) / repeat
+
+            size = sum(len(row.encode() if isinstance(row, str) else row) for row in rows)
+            self.stdout.write(f"{name:18} {size:10} {encode_time * 1e3:8.2f}ms {decode_time * 1e3:8.2f}ms")
+
+    def benchmark_context(self, sizes, budget, repeat=5):
+        with self.chatbot_modules(CONTEXT_TOKEN_BUDGET=None):
+            from context import build_context, count_tokens
+
+            self.stdout.write(f"{'answers':>8} {'json':>10} {'compact':>10} {'budget':>10} {'reduction':>10} "
+                              f"{'build':>10}   (tokens, budget of {budget} tokens)")
+            for size in sizes:
+                # the answers of rdmo contain a number of empty fields, which are removed from the context
+                project = get_project(1, size)
+                project["answers"] = [{**answer, "unit": "", "option": None, "text": ""}
+                                      for answer in project["answers"]]
+
+                json_tokens = count_tokens(json.dumps(project))
+                compact_tokens = count_tokens(build_context(project))
+
+                started = time.perf_counter()
+                for _ in range(repeat):
+                    context = build_context(project, budget)
+                build_time = (time.perf_counter() - started) / repeat
+
+                budget_tokens = count_tokens(context)
+                self.stdout.write(f"{size:8} {json_tokens:10} {compact_tokens:10} {budget_tokens:10} "
+                                  f"{1 - budget_tokens / json_tokens:9.1%} {build_time * 1e3:8.2f}ms")
+
+    async def benchmark_streaming(self, count, response_tokens, token_rate, intervals=(0, 0.01, 0.04, 0.1)):
+        from rdmo_chatbot.chatbot.fake import WORDS
+
+        with self.chatbot_modules():
+            from streaming import StreamBuffer
+
+        class Message:
+            # counts the emits and serializes the tokens, like chainlit does before they are sent
+            emits = 0
+
+            async def stream_token(self, token):
+                Message.emits += 1
+                json.dumps({"id": str(uuid.uuid4()), "token": token, "isSequence": False, "isInput": False})
+
+        async def stream(interval):
+            async with StreamBuffer(Message(), interval=interval) as stream_buffer:
+                for index in range(response_tokens):
+                    await asyncio.sleep(1 / token_rate)
+                    await stream_buffer.write(WORDS[index % len(WORDS)] + " ")
+
+        self.stdout.write(f"{'interval':>8} {'emits/response':>15} {'cpu/response':>13} {'duration':>9}   "
+                          f"({count} streams, {response_tokens} tokens at {token_rate:.0f} tokens/s)")
+        for interval in intervals:
+            Message.emits = 0
+            cpu_started, started = time.process_time(), time.perf_counter()
+            await asyncio.gather(*[stream(interval) for _ in range(count)])
+            cpu_time, elapsed = time.process_time() - cpu_started, time.perf_counter() - started
+
+            self.stdout.write(f"{interval * 1e3:6.0f}ms {Message.emits / count:15.1f} "
+                              f"{cpu_time / count * 1e3:11.2f}ms {elapsed:8.2f}s")
+
+    def create_redis_store(self, store_class, redis_client):
+        # the store is connected to the given client instead of CHATBOT_STORE_CONNECTION
+        from rdmo_chatbot.chatbot.stores.redis import APPEND_SCRIPT
+
+        store = store_class.__new__(store_class)
+        store.redis_client = redis_client
+        store.max_workers = redis_client.connection_pool.max_connections
+        store.append_script = store.redis_client.register_script(APPEND_SCRIPT)
+        store.compression = None
+        return store
+
+    async def benchmark_store_load(self, sessions, turns, redis_address):
+        import inspect
+
+        import redis
+        import redis.asyncio
+
+        with tempfile.TemporaryDirectory() as tmp, \
+                self.chatbot_modules(STORE_CONNECTION=str(Path(tmp) / "benchmark.sqlite3"), STORE_TTL=3600):
+            from rdmo_chatbot.chatbot.stores import AsyncStoreWrapper
+            from rdmo_chatbot.chatbot.stores.locmem import LocMemStore
+            from rdmo_chatbot.chatbot.stores.redis import AsyncRedisStore, RedisStore
+            from rdmo_chatbot.chatbot.stores.sqlite3 import Sqlite3Store
+
+            # fakeredis runs the commands on the event loop, therefore a redis server is needed
+            host, port = redis_address.rsplit(":", 1)
+            redis_kwargs = {"host": host, "port": int(port), "max_connections": 4}
+            stores = [("locmem", LocMemStore), ("sqlite3", Sqlite3Store)]
+            try:
+                redis.Redis(**redis_kwargs).ping()
+                stores += [
+                    ("redis", lambda: self.create_redis_store(RedisStore, redis.Redis(**redis_kwargs))),
+                    ("redis (async)", lambda: self.create_redis_store(
+                        AsyncRedisStore, redis.asyncio.Redis(**redis_kwargs)
+                    ))
+                ]
+            except redis.ConnectionError:
+                self.stdout.write(f"The redis stores are skipped, since there is no redis server at {redis_address}.")
+
+            self.stdout.write(f"{'store':14} {'sessions':>8} {'ops/s':>8} {'p50':>9} {'p99':>9} {'lag p99':>9}")
+            for name, create_store in stores:
+                # the store is wrapped like in the chatbot, synchronous stores are run in a thread pool
+                store = create_store()
+                if not inspect.iscoroutinefunction(store.get_history):
+                    store = AsyncStoreWrapper(store)
+
+                for count in sessions:
+                    latencies, lags = [], []
+                    monitor = asyncio.create_task(self.monitor_loop(lags))
+                    started = time.perf_counter()
+                    await asyncio.gather(*[
+                        self.run_store_session(store, f"benchmark-{name}-{count}-{index}", turns, latencies)
+                        for index in range(count)
+                    ])
+                    elapsed = time.perf_counter() - started
+
+                    # the monitor records at least one delay, even if the sessions never waited
+                    await asyncio.sleep(0.01)
+                    monitor.cancel()
+
+                    p50, p99, lag = percentile(latencies, 50), percentile(latencies, 99), percentile(lags, 99)
+                    self.stdout.write(f"{name:14} {count:8} {len(latencies) / elapsed:8.0f} "
+                                      f"{p50 * 1e3:7.2f}ms {p99 * 1e3:7.2f}ms {lag * 1e3:7.2f}ms")
+
+    async def run_store_session(self, store, user_identifier, turns, latencies):
+        from langchain_core.messages import AIMessage, HumanMessage
+
+        # the history is loaded once, each turn appends two messages,
+        # between the turns, the other sessions can run, like while waiting for the llm
+        await store.get_history(user_identifier, 1)
+        for turn in range(turns):
+            await asyncio.sleep(0)
+            started = time.perf_counter()
+            await store.append_messages(user_identifier, 1, [
+                HumanMessage(content=QUESTIONS[turn % len(QUESTIONS)]),
+                AIMessage(content=f"Response {turn}")
+            ])
+            latencies.append(time.perf_counter() - started)
+
+    async def monitor_loop(self, lags, interval=0.005):
+        # the event loop was blocked, if the sleep takes longer than the interval
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(interval)
+            lags.append(time.perf_counter() - started - interval)
+
+    async def benchmark_round_trips(self, sizes, count=100):
+        import inspect
+
+        import fakeredis
+        import redis.asyncio.connection
+        import redis.connection
+        from langchain_core.messages import AIMessage, HumanMessage
+
+        with self.chatbot_modules(STORE_TTL=3600):
+            from rdmo_chatbot.chatbot.stores.redis import AsyncRedisStore, RedisStore
+
+        # every command or pipeline sent to the server is one round-trip
+        round_trips = 0
+        send_packed_command = redis.connection.AbstractConnection.send_packed_command
+        async_send_packed_command = redis.asyncio.connection.AbstractConnection.send_packed_command
+
+        def count_send_packed_command(connection, *args, **kwargs):
+            nonlocal round_trips
+            round_trips += 1
+            return send_packed_command(connection, *args, **kwargs)
+
+        async def count_async_send_packed_command(connection, *args, **kwargs):
+            nonlocal round_trips
+            round_trips += 1
+            return await async_send_packed_command(connection, *args, **kwargs)
+
+        async def call(method, *args, **kwargs):
+            result = method(*args, **kwargs)
+            return await result if inspect.isawaitable(result) else result
+
+        async def measure(method, *args, **kwargs):
+            before = round_trips
+            await call(method, *args, **kwargs)
+            return round_trips - before
+
+        redis.connection.AbstractConnection.send_packed_command = count_send_packed_command
+        redis.asyncio.connection.AbstractConnection.send_packed_command = count_async_send_packed_command
+        try:
+            self.stdout.write(f"{'store':16} {'messages':>8} {'start':>6} {'turn':>6} {'migrate':>8} {'turn time':>10}"
+                              f"   (round-trips)")
+            for store_class, client_class in [(RedisStore, fakeredis.FakeRedis),
+                                               (AsyncRedisStore, fakeredis.FakeAsyncRedis)]:
+                store = self.create_redis_store(store_class, client_class())
+
+                # the script is loaded into the server once
+                await call(store.append_messages, "warmup", 0, [HumanMessage(content=QUESTIONS[0])])
+
+                for size in sizes:
+                    history = [
+                        AIMessage(content=f"Response {index}") if index % 2 else HumanMessage(content=QUESTIONS[0])
+                        for index in range(size)
+                    ]
+                    user_identifier = f"benchmark-{size}"
+                    await call(store.set_history, user_identifier, 1, history)
+
+                    # on_chat_start loads the history, each turn appends two messages
+                    start = await measure(store.get_history, user_identifier, 1)
+
+                    turn = 0
+                    started = time.perf_counter()
+                    for _ in range(count):
+                        turn += await measure(store.append_messages, user_identifier, 1, [
+                            HumanMessage(content=QUESTIONS[1]), AIMessage(content="Response")
+                        ])
+                    turn_time = (time.perf_counter() - started) / count
+
+                    # a history stored by an earlier version is migrated when it is loaded
+                    await call(store.redis_client.set, f"history:{user_identifier}:2",
+                               json.dumps([message.dict() for message in history]))
+                    migrate = await measure(store.get_history, user_identifier, 2)
+
+                    self.stdout.write(f"{store_class.__name__:16} {size:8} {start:6} {turn / count:6.1f} "
+                                      f"{migrate:8} {turn_time * 1e6:8.1f}µs")
+        finally:
+            redis.connection.AbstractConnection.send_packed_command = send_packed_command
+            redis.asyncio.connection.AbstractConnection.send_packed_command = async_send_packed_command
+
+    def benchmark_semantic(self, sizes, dimensions, count):
+        import random
+
+        with self.chatbot_modules():
+            from rdmo_chatbot.chatbot.caches.semantic import SemanticPartition, normalize, np
+
+        rng = random.Random(0)
+        count = min(count, 1000)
+
+        def get_vectors(size):
+            if np is not None:
+                generator = np.random.default_rng(rng.getrandbits(32))
+                vectors = generator.standard_normal((size, dimensions), dtype=np.float32)
+                return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+            return [normalize([rng.gauss(0, 1) for _ in range(dimensions)]) for _ in range(size)]
+
+        self.stdout.write(f"{'entries':>8} {'add':>10} {'p50':>10} {'p99':>10} {'MiB':>8}   "
+                          f"({dimensions} dimensions, {'numpy' if np is not None else 'python'})")
+        for size in sizes:
+            partition = SemanticPartition()
+            vectors = get_vectors(size)
+
+            started = time.perf_counter()
+            for index, vector in enumerate(vectors):
+                partition.add(vector, "", f"Response {index}", index)
+            add_time = (time.perf_counter() - started) / size
+
+            # half of the lookups are hits, the other half are misses
+            queries = [vectors[rng.randrange(size)] for _ in range(count // 2)]
+            queries += list(get_vectors(count - count // 2))
+
+            latencies = []
+            for vector in queries:
+                started = time.perf_counter()
+                partition.search(vector, "", 0.95)
+                latencies.append(time.perf_counter() - started)
+
+            memory = partition.matrix.nbytes / 2 ** 20 if np is not None else float("nan")
+            self.stdout.write(f"{size:8} {add_time * 1e6:8.2f}µs {percentile(latencies, 50) * 1e3:8.2f}ms "
+                              f"{percentile(latencies, 99) * 1e3:8.2f}ms {memory:8.1f}")
+
+    def get_benchmark_config(self, store, options, tmp):
+        chatbot_config = self.get_chatbot_config()
+        chatbot_config.update({
+            "ADAPTER": "rdmo_chatbot.chatbot.adapter.FakeLangChainAdapter",
+            "LLM_ARGS": {
+                "latency": options["latency"],
+                "tokens_per_second": options["token_rate"],
+                "response_tokens": options["response_tokens"]
+            },
+            "STORE": STORES[store],
+            "ROUTER": None,
+            "RESPONSE_CACHE": None,
+            "RESPONSE_CACHE_SEMANTIC": False,
+            "METRICS": False
+        })
+
+        if store == "sqlite3":
+            chatbot_config["STORE_CONNECTION"] = str(Path(tmp) / "benchmark.sqlite3")
+        elif store == "redis":
+            host, port = options["redis"].rsplit(":", 1)
+            chatbot_config["STORE_CONNECTION"] = {"host": host, "port": int(port), "db": 0}
+
+        return chatbot_config
+
+    async def wait_for_server(self, url, process):
+        import httpx
+
+        async with httpx.AsyncClient() as client:
+            deadline = time.monotonic() + STARTUP_TIMEOUT
+            while time.monotonic() < deadline:
+                if process.poll() is not None:
+                    raise CommandError("The chatbot server exited during startup.")
+                try:
+                    await client.get(url)
+                    return
+                except httpx.TransportError:
+                    await asyncio.sleep(0.5)
+
+        raise CommandError("The chatbot server did not start in time.")
+
+    async def run_benchmark(self, process, chatbot_config, options):
+        import jwt
+
+        url = f"http://127.0.0.1:{options['port']}"
+        await self.wait_for_server(url, process)
+
+        clients = [Client(url, "/ws/socket.io", index, options["answers"]) for index in range(options["clients"])]
+        tokens = [
+            jwt.encode({
+                "identifier": client.user_identifier,
+                "display_name": client.user_identifier,
+                "metadata": {}
+            }, settings.CHATBOT_AUTH_SECRET, algorithm="HS256")
+            for client in clients
+        ]
+
+        memory_before = get_rss(process.pid)
+        await asyncio.gather(*[client.connect(token) for client, token in zip(clients, tokens)])
+
+        async def run_turns(client):
+            for turn in range(options["turns"]):
+                await client.send(QUESTIONS[turn % len(QUESTIONS)])
+
+        started = time.monotonic()
+        await asyncio.gather(*[run_turns(client) for client in clients])
+        elapsed = time.monotonic() - started
+
+        memory_after = get_rss(process.pid)
+        await asyncio.gather(*[client.disconnect() for client in clients])
+
+        latencies = [latency for client in clients for latency in client.latencies]
+        first_token_latencies = [latency for client in clients for latency in client.first_token_latencies]
+
+        return {
+            "throughput": len(latencies) / elapsed,
+            "p50": percentile(latencies, 50),
+            "p95": percentile(latencies, 95),
+            "p99": percentile(latencies, 99),
+            "ttft": percentile(first_token_latencies, 50),
+            "memory": (memory_after - memory_before) / len(clients)
+            if memory_before is not None and memory_after is not None else None,
+            # the bytes received by a client for one turn should not grow with the length of the conversation
+            "first_turn_bytes": sum(client.turn_sizes[0] for client in clients) / len(clients),
+            "last_turn_bytes": sum(client.turn_sizes[-1] for client in clients) / len(clients),
+            # each client sends its own project, so the sizes are only compared for the same client
+            "growing_contact_sizes": [
+                client.contact_sizes for client in clients if len(set(client.contact_sizes)) > 1
+            ]
+        }
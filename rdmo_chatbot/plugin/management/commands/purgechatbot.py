@@ -0,0 +1,39 @@
+import asyncio
+import importlib
+
+from django.conf import settings
+from django.core.management.base import CommandError
+
+from .runchatbot import Command as RunChatbotCommand
+
+
+class Command(RunChatbotCommand):
+    help = "Removes the chat histories which were not updated within CHATBOT_STORE_TTL from the store."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--ttl", type=int, default=getattr(settings, "CHATBOT_STORE_TTL", None),
+                            help="Remove histories which were not updated for this many seconds.")
+        parser.add_argument("--batch-size", type=int, default=getattr(settings, "CHATBOT_STORE_PURGE_BATCH_SIZE", 1000),
+                            help="Number of histories removed in one transaction.")
+        parser.add_argument("--pause", type=float, default=0.1,
+                            help="Seconds to wait between the batches, so that other writes are not blocked.")
+
+    def handle(self, *args, **options):
+        if not options["ttl"]:
+            raise CommandError("Please set CHATBOT_STORE_TTL or use --ttl.")
+
+        # the store is created and purged like by the sweeper of the chatbot process
+        with self.chatbot_modules():
+            from retention import purge_expired
+            from utils import get_config, get_store
+
+            store_module_name, store_class_name = settings.CHATBOT_STORE.rsplit(".", 1)
+            store_class = getattr(importlib.import_module(store_module_name), store_class_name)
+            if not hasattr(store_class, "purge_expired"):
+                raise CommandError(f"{settings.CHATBOT_STORE} does not need to be purged, "
+                                   "it expires the histories itself.")
+
+            store = get_store(get_config())
+            total = asyncio.run(purge_expired(store, options["ttl"], options["batch_size"], options["pause"]))
+
+        self.stdout.write(f"Removed {total} expired histories.")
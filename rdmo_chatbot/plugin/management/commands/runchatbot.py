@@ -2,11 +2,15 @@ import importlib
 import json
 import logging
 import os
+import signal
 import subprocess
+import sys
+import time
+from contextlib import contextmanager
 from pathlib import Path
 
 from django.conf import settings
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
 from django.template.exceptions import TemplateDoesNotExist
 from django.template.loader import render_to_string
 
@@ -14,6 +18,18 @@ from rdmo.core.utils import get_languages
 
 logger = logging.getLogger(__name__)
 
+# stores which keep the history in the memory of one process
+PROCESS_LOCAL_STORES = [
+    "rdmo_chatbot.chatbot.stores.locmem.LocMemStore"
+]
+
+# workers which exit earlier than this (in seconds) are restarted with an increasing delay
+MIN_UPTIME = 10
+MAX_RESTART_DELAY = 60
+
+# the number of imports which are reported by --profile-startup
+PROFILE_LIMIT = 20
+
 
 class Command(BaseCommand):
     def add_arguments(self, parser):
@@ -23,30 +39,45 @@ class Command(BaseCommand):
         parser.add_argument("--port", dest="port", default="8080")
         parser.add_argument("--root-path", dest="root-path", default=None)
         parser.add_argument("--chainlit-path", dest="chainlit-path", default="chainlit")
+        parser.add_argument("--workers", dest="workers", type=int, default=1,
+                            help="Number of chainlit workers, which listen on consecutive ports.")
+        parser.add_argument("--profile-startup", dest="profile-startup", action="store_true", default=False,
+                            help="Report the time needed to import the chatbot app and exit.")
 
     def handle(self, *args, **options):
         # find the path of the rdmo_chatbot directory
         chatbot_module = importlib.import_module("rdmo_chatbot.chatbot")
         chatbot_path = chatbot_module.__path__[0]
 
-        chainlit_path = options["chainlit-path"]
-        chainlit_app_path = Path(chatbot_path) / "app.py"
+        chatbot_config = self.get_chatbot_config()
+        chatbot_cwd = getattr(settings, "CHATBOT_PATH", None) or chatbot_path
+        chatbot_env = self.get_chatbot_env(chatbot_config)
 
-        chatbot_args = [chainlit_path, "run", chainlit_app_path, "--headless"] + [
-            f"--{key}" if value is True else f"--{key}={value}"
-            for key, value in options.items()
-            if key in ["watch", "debug", "host", "port", "root-path"] and value
-        ]
+        if options["profile-startup"]:
+            self.profile_startup(chatbot_path, chatbot_cwd, chatbot_env)
+        elif options["workers"] > 1:
+            store = chatbot_config.get("STORE", "")
+            if store in PROCESS_LOCAL_STORES:
+                raise CommandError(f"{store} can not be shared between workers, please use a different store.")
 
+            self.run_workers(options, chatbot_path, chatbot_cwd, chatbot_env)
+        else:
+            subprocess.check_call(
+                self.get_chatbot_args(options, chatbot_path, options["port"]),
+                cwd=chatbot_cwd,
+                env=chatbot_env
+            )
+
+    def get_chatbot_config(self):
         chatbot_config = {
             name[8:]: getattr(settings, name)
             for name in dir(settings)
             if name.startswith("CHATBOT_")
         }
 
-        # add templates to config
+        # add templates to config, the templates are rendered only once and reused when workers are restarted
         for lang_code, _, _ in get_languages():
-            for key in ["confirmation", "start", "continuation"]:
+            for key in ["confirmation", "start", "continuation", "queue", "busy"]:
                 template_name = f"chatbot/chatbot_{key}_{lang_code}.txt"
                 try:
                     rendered_template  = render_to_string(template_name)
@@ -54,15 +85,130 @@ class Command(BaseCommand):
                 except TemplateDoesNotExist:
                     pass
 
-        chatbot_cwd = getattr(settings, "CHATBOT_PATH", None) or chatbot_path
+        return chatbot_config
+
+    @contextmanager
+    def chatbot_modules(self, **chatbot_config):
+        # the modules of the chatbot read the config from the environment and import each other from the chatbot
+        # directory, both are only changed while the modules are imported and used in this process, e.g. by a benchmark
+        chatbot_path = importlib.import_module("rdmo_chatbot.chatbot").__path__[0]
+        environ = os.environ.get("CHATBOT_CONFIG")
 
+        os.environ["CHATBOT_CONFIG"] = json.dumps({**self.get_chatbot_config(), **chatbot_config})
+        sys.path.insert(0, chatbot_path)
+        try:
+            yield
+        finally:
+            sys.path.remove(chatbot_path)
+            if environ is None:
+                os.environ.pop("CHATBOT_CONFIG", None)
+            else:
+                os.environ["CHATBOT_CONFIG"] = environ
+
+    def get_chatbot_env(self, chatbot_config):
         chatbot_env = os.environ.copy()
         chatbot_env["PYTHONPATH"] = Path.cwd()
         chatbot_env["CHAINLIT_AUTH_SECRET"] = settings.CHATBOT_AUTH_SECRET
         chatbot_env["CHATBOT_CONFIG"] = json.dumps(chatbot_config)
+        return chatbot_env
 
-        subprocess.check_call(
-            chatbot_args,
+    def get_chatbot_args(self, options, chatbot_path, port):
+        chainlit_path = options["chainlit-path"]
+        chainlit_app_path = Path(chatbot_path) / "app.py"
+
+        return [chainlit_path, "run", chainlit_app_path, "--headless", f"--port={port}"] + [
+            f"--{key}" if value is True else f"--{key}={value}"
+            for key, value in options.items()
+            if key in ["watch", "debug", "host", "root-path"] and value
+        ]
+
+    def profile_startup(self, chatbot_path, chatbot_cwd, chatbot_env):
+        # import the app in a separate interpreter, like chainlit does, and let python report the import times
+        env = {**chatbot_env, "PYTHONPATH": os.pathsep.join([chatbot_path, str(chatbot_env["PYTHONPATH"])])}
+
+        started = time.monotonic()
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", "import app"],
             cwd=chatbot_cwd,
-            env=chatbot_env
+            env=env,
+            capture_output=True,
+            text=True
         )
+        elapsed = time.monotonic() - started
+
+        imports = []
+        for line in result.stderr.splitlines():
+            if not line.startswith("import time:"):
+                self.stderr.write(line)
+                continue
+
+            # e.g. "import time:       123 |        456 |   encodings.aliases", nested imports are indented
+            try:
+                self_us, cumulative_us, name = line[len("import time:"):].split("|")
+                imports.append((int(self_us), int(cumulative_us), name[1:].rstrip()))
+            except ValueError:
+                pass  # the header line
+
+        if result.returncode != 0:
+            raise CommandError("The chatbot app could not be imported.")
+
+        self.stdout.write(f"Startup took {elapsed:.2f} s, importing the app took {imports[-1][1] / 1e6:.2f} s.")
+
+        self.stdout.write("\nSlowest top-level imports (cumulative):")
+        for self_us, cumulative_us, name in sorted(
+            (entry for entry in imports if not entry[2].startswith(" ")), key=lambda entry: entry[1], reverse=True
+        )[:PROFILE_LIMIT]:
+            self.stdout.write(f"{cumulative_us / 1000:10.1f} ms  {name.strip()}")
+
+        self.stdout.write("\nSlowest modules (self):")
+        for self_us, cumulative_us, name in sorted(imports, reverse=True)[:PROFILE_LIMIT]:
+            self.stdout.write(f"{self_us / 1000:10.1f} ms  {name.strip()}")
+
+    def run_workers(self, options, chatbot_path, chatbot_cwd, chatbot_env):
+        # start one chainlit process for each worker on consecutive ports and restart workers which exit
+        ports = [int(options["port"]) + index for index in range(options["workers"])]
+
+        def start(port):
+            self.stdout.write(f"Starting chatbot worker on port {port}")
+            process = subprocess.Popen(
+                self.get_chatbot_args(options, chatbot_path, port),
+                cwd=chatbot_cwd,
+                env=chatbot_env
+            )
+            return {"process": process, "started": time.monotonic(), "failures": 0, "restart": None}
+
+        # stop the workers when the supervisor is stopped, e.g. by systemd
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+        workers = {}
+        try:
+            for port in ports:
+                workers[port] = start(port)
+
+            while True:
+                time.sleep(1)
+                for port, worker in workers.items():
+                    if worker["restart"] is not None:
+                        if time.monotonic() >= worker["restart"]:
+                            workers[port] = {**start(port), "failures": worker["failures"]}
+                        continue
+
+                    returncode = worker["process"].poll()
+                    if returncode is None:
+                        continue
+
+                    # workers which crash right after starting are restarted with a delay
+                    failures = worker["failures"] + 1 if time.monotonic() - worker["started"] < MIN_UPTIME else 0
+                    delay = min(2 ** failures - 1, MAX_RESTART_DELAY)
+                    self.stderr.write(f"Chatbot worker on port {port} exited with {returncode}, "
+                                      f"restarting in {delay} seconds")
+                    worker.update(failures=failures, restart=time.monotonic() + delay)
+        finally:
+            for worker in workers.values():
+                if worker["process"].poll() is None:
+                    worker["process"].terminate()
+            for worker in workers.values():
+                try:
+                    worker["process"].wait(timeout=10)
+                except subprocess.TimeoutExpired:
+                    worker["process"].kill()
@@ -1,4 +1,6 @@
-from .utils import get_chatbot_token
+from django.conf import settings
+
+from .utils import check_chatbot_token, get_chatbot_token
 
 
 class ChatbotMiddleware:
@@ -9,10 +11,12 @@ class ChatbotMiddleware:
         response = self.get_response(request)
 
         if request.user.is_authenticated:
-            response.set_cookie("chatbot_token", get_chatbot_token(request.user))
+            token = request.COOKIES.get("chatbot_token")
+            if not (getattr(settings, "CHATBOT_TOKEN_REUSE", True) and check_chatbot_token(token, request.user)):
+                response.set_cookie("chatbot_token", get_chatbot_token(request.user))
         else:
-            response.delete_cookie("chatbot_token")
-            response.delete_cookie("access_token")
-            response.delete_cookie("X-Chainlit-Session-id")
+            for cookie in ["chatbot_token", "access_token", "X-Chainlit-Session-id"]:
+                if cookie in request.COOKIES:
+                    response.delete_cookie(cookie)
 
         return response
@@ -3,6 +3,8 @@ from rest_framework import serializers
 from rdmo.projects.exports import AnswersExportMixin
 from rdmo.projects.models import Project
 
+from .cache import get_project_answers
+
 
 class ProjectSerializer(serializers.ModelSerializer):
 
@@ -18,6 +20,10 @@ class ProjectSerializer(serializers.ModelSerializer):
         ]
 
     def get_answers(self, obj):
+        return get_project_answers(obj, self.export_answers)
+
+    @staticmethod
+    def export_answers(obj):
         export_plugin = AnswersExportMixin()
         export_plugin.project = obj
         export_plugin.snapshot = None
@@ -0,0 +1,35 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from rdmo.domain.models import Attribute
+from rdmo.options.models import Option, OptionSet
+from rdmo.projects.models import Project, Value
+from rdmo.questions.models import Catalog, Page, Question, QuestionSet, Section
+
+from .cache import bump_project_version, bump_questions_version
+
+# the models whose changes alter the exported answers of all projects
+QUESTIONS_MODELS = [Catalog, Section, Page, QuestionSet, Question, OptionSet, Option, Attribute]
+
+
+@receiver(post_save, sender=Value)
+@receiver(post_delete, sender=Value)
+def value_changed(sender, instance, **kwargs):
+    # values of snapshots are not part of the exported answers
+    if instance.project_id and instance.snapshot_id is None:
+        bump_project_version(instance.project_id)
+
+
+@receiver(post_save, sender=Project)
+@receiver(post_delete, sender=Project)
+def project_changed(sender, instance, **kwargs):
+    bump_project_version(instance.id)
+
+
+def questions_changed(sender, instance, **kwargs):
+    bump_questions_version()
+
+
+for model in QUESTIONS_MODELS:
+    post_save.connect(questions_changed, sender=model)
+    post_delete.connect(questions_changed, sender=model)
@@ -17,16 +17,28 @@ const getProjectId = async (args) => {
 const getProject = async (args) => {
   const url = `${baseUrl}/api/v1/chatbot/projects/${projectId}/`
 
+  const headers = {
+    'Content-Type': 'application/json'
+  }
+
+  // only fetch the project if it changed since the last call of the chatbot
+  if (args?.etag) {
+    headers['If-None-Match'] = args.etag
+  }
+
   const response = await fetch(url, {
     method: 'GET',
-    headers: {
-      'Content-Type': 'application/json'
-    }
+    headers,
+    cache: 'no-store'
   })
 
+  if (response.status === 304) {
+    return { etag: args.etag, modified: false }
+  }
+
   const data = await response.json()
 
-  return data
+  return { etag: response.headers.get('ETag'), modified: true, project: data }
 }
 
 const toggleCopilot = async (args) => {
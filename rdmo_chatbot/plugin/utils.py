@@ -1,4 +1,6 @@
+import time
 from datetime import datetime, timedelta, timezone
+from functools import lru_cache
 
 from django import template
 from django.conf import settings
@@ -15,7 +17,32 @@ def get_chatbot_token(user):
         "identifier": user.username,
         "display_name": get_full_name(user),
         "metadata": {},
-        "exp": datetime.now(timezone.utc) + timedelta(minutes=60 * 24),
+        "exp": datetime.now(timezone.utc) + timedelta(seconds=getattr(settings, "CHATBOT_TOKEN_LIFETIME", 86400)),
     }
 
     return jwt.encode(token_data, settings.CHATBOT_AUTH_SECRET, algorithm="HS256")
+
+
+@lru_cache(maxsize=1024)
+def decode_chatbot_token(token, secret):
+    # invalid and expired tokens are cached as None, they will not become valid again
+    try:
+        return jwt.decode(token, secret, algorithms=["HS256"])
+    except jwt.exceptions.InvalidTokenError:
+        return None
+
+
+def check_chatbot_token(token, user):
+    # the token can be reused if it belongs to the user, still contains the current name of the user
+    # (which is used by the chatbot to address the user) and does not expire within the refresh threshold
+    if not token:
+        return False
+
+    token_data = decode_chatbot_token(token, settings.CHATBOT_AUTH_SECRET)
+    if token_data is None or token_data.get("identifier") != user.username:
+        return False
+
+    if token_data.get("display_name") != get_full_name(user):
+        return False
+
+    return token_data.get("exp", 0) - time.time() > getattr(settings, "CHATBOT_TOKEN_REFRESH", 3600)
@@ -1,10 +1,15 @@
+from django.utils.http import parse_etags, quote_etag
+
+from rest_framework import status
 from rest_framework.mixins import RetrieveModelMixin
+from rest_framework.response import Response
 from rest_framework.viewsets import GenericViewSet
 
 from rdmo.core.permissions import HasModelPermission
 from rdmo.projects.models import Project
 from rdmo.projects.permissions import HasProjectsPermission
 
+from .cache import get_project_etag
 from .serializers import ProjectSerializer
 
 
@@ -12,3 +17,17 @@ class ProjectViewSet(RetrieveModelMixin, GenericViewSet):
     permission_classes = (HasModelPermission | HasProjectsPermission, )
     serializer_class = ProjectSerializer
     queryset = Project.objects.all()
+
+    def retrieve(self, request, *args, **kwargs):
+        instance = self.get_object()
+
+        # the etag changes whenever a value, the project itself, the questions or the language change
+        etag = quote_etag(get_project_etag(instance.id))
+        headers = {"ETag": etag, "Cache-Control": "private, no-cache", "Vary": "Accept-Language, Cookie"}
+
+        if_none_match = request.headers.get("If-None-Match")
+        if if_none_match and etag in parse_etags(if_none_match):
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+        serializer = self.get_serializer(instance)
+        return Response(serializer.data, headers=headers)
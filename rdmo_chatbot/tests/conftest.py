@@ -0,0 +1,20 @@
+import json
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+# the modules of the chatbot read the config from the environment and import each other from the chatbot directory,
+# the config is parsed once, single settings are changed by the tests using monkeypatch
+os.environ["CHATBOT_CONFIG"] = json.dumps({
+    "STREAM": True,
+    "STORE_TTL": 3600,
+    "LLM_CLIENT": {"retries": 0, "timeout": 5}
+})
+sys.path.insert(0, str(Path(__file__).parent.parent / "chatbot"))
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
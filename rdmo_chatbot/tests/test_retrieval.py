@@ -0,0 +1,94 @@
+import asyncio
+
+import pytest
+
+pytestmark = pytest.mark.anyio
+
+ANSWERS = [
+    {"question": "Where is the data stored?", "text": "On the servers of the university"},
+    {"question": "Which license is used?", "text": "CC BY 4.0"},
+    {"question": "How is the metadata documented?", "text": "Using DataCite"},
+]
+
+
+class Embeddings:
+    # embeds every text as the same vector, fails while failing is set, and waits for the event before it returns
+
+    def __init__(self):
+        self.failing = False
+        self.calls = 0
+        self.event = asyncio.Event()
+        self.event.set()
+
+    async def embed(self):
+        self.calls += 1
+        await self.event.wait()
+        if self.failing:
+            raise ConnectionError("The embeddings are not available.")
+
+    async def aembed_documents(self, texts):
+        await self.embed()
+        return [[1.0, 0.0] for _ in texts]
+
+    async def aembed_query(self, text):
+        await self.embed()
+        return [1.0, 0.0]
+
+
+@pytest.fixture
+def embeddings():
+    return Embeddings()
+
+
+@pytest.fixture
+def index(embeddings):
+    from retrieval import ProjectIndex
+
+    return ProjectIndex(embeddings)
+
+
+async def test_failing_embeddings_fall_back_to_bm25(index, embeddings):
+    embeddings.failing = True
+    await index.update(ANSWERS)
+
+    assert not index.embedding_ready
+    assert (await index.search("license", 1))[0]["text"] == "CC BY 4.0"
+
+
+async def test_failed_embeddings_are_retried(index, embeddings):
+    embeddings.failing = True
+    await index.update(ANSWERS)
+
+    embeddings.failing = False
+    await index.update(ANSWERS)
+    assert index.embedding_ready
+
+
+async def test_failing_query_falls_back_to_bm25(index, embeddings):
+    await index.update(ANSWERS)
+
+    embeddings.failing = True
+    assert (await index.search("license", 1))[0]["text"] == "CC BY 4.0"
+
+
+async def test_concurrent_updates_embed_the_answers_once(index, embeddings):
+    embeddings.event.clear()
+    updates = asyncio.gather(index.update(ANSWERS), index.update(ANSWERS))
+    await asyncio.sleep(0)
+    embeddings.event.set()
+    await updates
+
+    assert embeddings.calls == 1
+
+
+async def test_search_skips_answers_removed_during_the_query(index, embeddings):
+    await index.update(ANSWERS)
+
+    # the answers are updated while the query is embedded
+    embeddings.event.clear()
+    search = asyncio.create_task(index.search("license", 3))
+    await asyncio.sleep(0)
+    await index.update(ANSWERS[:1])
+    embeddings.event.set()
+
+    assert await search == ANSWERS[:1]
@@ -0,0 +1,229 @@
+import asyncio
+import json
+
+import pytest
+
+pytestmark = pytest.mark.anyio
+
+BACKEND_ADAPTER = "rdmo_chatbot.chatbot.adapter.OpenAILangChainAdapter"
+
+COOLDOWN = 0.5
+PROBE_INTERVAL = 0.1
+
+INPUTS = {"system_prompt": "", "context": "", "history": [], "content": "Hello"}
+
+
+class StubBackend:
+    # a local http server, which answers like an openai compatible llm server (e.g. vllm) with the name of the backend,
+    # its mode can be changed while it is running: "ok", "error" (status 500), or "drop" (after the first token)
+
+    def __init__(self, name):
+        self.name = name
+        self.mode = "ok"
+        self.healthy = True
+        self.requests = 0
+        self.server = None
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server.sockets[0].getsockname()[1]}"
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle, "127.0.0.1", 0)
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def handle(self, reader, writer):
+        # every connection is closed after one request
+        try:
+            _, path, _ = (await reader.readline()).decode().split(" ", 2)
+            headers = {}
+            while (line := await reader.readline()) not in (b"\r\n", b""):
+                key, value = line.decode().split(":", 1)
+                headers[key.strip().lower()] = value.strip()
+            body = await reader.readexactly(int(headers.get("content-length", 0)))
+
+            if path.endswith("/health"):
+                await self.respond(writer, 200 if self.healthy else 503, b"{}")
+                return
+
+            self.requests += 1
+            tokens = [self.name, " answered"]
+            if self.mode == "error":
+                await self.respond(writer, 500, b'{"error": {"message": "The stub backend failed."}}')
+            elif json.loads(body or b"{}").get("stream"):
+                await self.stream(writer, tokens)
+            else:
+                await self.respond(writer, 200, json.dumps({
+                    "id": "stub", "object": "chat.completion", "created": 0, "model": "stub",
+                    "choices": [{"index": 0, "message": {"role": "assistant", "content": "".join(tokens)},
+                                 "finish_reason": "stop"}],
+                    "usage": {"prompt_tokens": 1, "completion_tokens": len(tokens), "total_tokens": len(tokens) + 1}
+                }).encode())
+        except (ConnectionError, ValueError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def respond(self, writer, status, body):
+        writer.write(f"HTTP/1.1 {status} Stub\r\nContent-Type: application/json\r\nContent-Length: {len(body)}\r\n"
+                     f"Connection: close\r\n\r\n".encode() + body)
+        await writer.drain()
+
+    async def stream(self, writer, tokens):
+        # the events are sent in chunks, a dropped connection is detected, since the last chunk is missing
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nTransfer-Encoding: chunked\r\n"
+                     b"Connection: close\r\n\r\n")
+        for index, token in enumerate([*tokens, None]):
+            delta = {"role": "assistant", "content": token} if token is not None else {}
+            event = "data: " + json.dumps({
+                "id": "stub", "object": "chat.completion.chunk", "created": 0, "model": "stub",
+                "choices": [{"index": 0, "delta": delta, "finish_reason": None if token is not None else "stop"}]
+            }) + "\n\n"
+            if token is None:
+                event += "data: [DONE]\n\n"
+            writer.write(f"{len(event.encode()):x}\r\n".encode() + event.encode() + b"\r\n")
+            await writer.drain()
+            if self.mode == "drop" and index == 0:
+                return
+            await asyncio.sleep(0.01)
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+
+
+class Message:
+
+    def __init__(self):
+        self.content = ""
+
+    async def stream_token(self, token):
+        self.content += token
+
+
+def get_router_options(backends, health=False):
+    return {
+        "failure_threshold": 2,
+        "cooldown": COOLDOWN,
+        "probe_interval": PROBE_INTERVAL,
+        "backends": [{
+            "name": backend.name,
+            "adapter": BACKEND_ADAPTER,
+            "llm_args": {"model": "stub", "openai_api_base": f"{backend.url}/v1", "openai_api_key": "stub"},
+            "health_url": f"{backend.url}/health" if health else None
+        } for backend in backends]
+    }
+
+
+@pytest.fixture(autouse=True)
+def http_client():
+    # the shared http client is bound to the event loop of the test
+    import clients
+
+    clients.get_http_client.cache_clear()
+    clients.get_http_transport.cache_clear()
+
+
+@pytest.fixture
+async def backends():
+    backends = [StubBackend("a"), StubBackend("b")]
+    for backend in backends:
+        await backend.start()
+    yield backends
+    for backend in backends:
+        await backend.stop()
+
+
+@pytest.fixture
+def router_adapter(backends):
+    pytest.importorskip("langchain_openai")
+    from adapter import RouterLangChainAdapter
+
+    router_adapter = RouterLangChainAdapter()
+    router_adapter.router = RouterLangChainAdapter.create_router(get_router_options(backends))
+    return router_adapter
+
+
+async def run(router_adapter):
+    message = Message()
+    await router_adapter.run_chain(None, message, INPUTS)
+    return message.content
+
+
+async def test_first_backend_answers(router_adapter):
+    assert await run(router_adapter) == "a answered"
+
+
+async def test_failover_before_first_token(router_adapter, backends):
+    backends[0].mode = "error"
+    assert await run(router_adapter) == "b answered"
+
+
+async def test_circuit_opens_after_failure_threshold(router_adapter, backends):
+    a, _ = backends
+    a.mode = "error"
+    await run(router_adapter)
+    await run(router_adapter)
+    assert router_adapter.router.backends[0].opened is not None
+
+    # a backend with an open circuit receives no requests
+    requests = a.requests
+    assert await run(router_adapter) == "b answered"
+    assert a.requests == requests
+
+
+async def test_circuit_closes_after_cooldown(router_adapter, backends):
+    a, _ = backends
+    a.mode = "error"
+    await run(router_adapter)
+    await run(router_adapter)
+
+    # the trial request after the cooldown closes the circuit again
+    a.mode = "ok"
+    await asyncio.sleep(COOLDOWN)
+    assert await run(router_adapter) == "a answered"
+    assert router_adapter.router.backends[0].opened is None
+
+
+async def test_no_failover_after_first_token(router_adapter, backends):
+    import httpx
+    import openai
+
+    a, b = backends
+    a.mode = "drop"
+    with pytest.raises((httpx.HTTPError, openai.APIError)):
+        await run(router_adapter)
+    assert b.requests == 0
+
+
+async def test_first_token_without_streaming(router_adapter, monkeypatch):
+    import adapter
+    from adapter import LangChainAdapter
+
+    monkeypatch.setattr(adapter.config, "STREAM", False)
+
+    first_tokens = []
+    await LangChainAdapter.run_chain(router_adapter, router_adapter.chains["a"], Message(), INPUTS,
+                                     on_first_token=lambda: first_tokens.append(True))
+    assert first_tokens == [True]
+
+
+async def test_health_probe(backends):
+    from router import Backend, Router
+
+    a, _ = backends
+    router = Router([Backend(backend.name, None, f"{backend.url}/health") for backend in backends],
+                    probe_interval=PROBE_INTERVAL)
+    router.select()
+    try:
+        # a failing probe opens the circuit at once, a successful probe closes it again
+        a.healthy = False
+        await asyncio.sleep(PROBE_INTERVAL * 3)
+        assert router.backends[0].opened is not None
+
+        a.healthy = True
+        await asyncio.sleep(PROBE_INTERVAL * 3)
+        assert router.backends[0].opened is None
+    finally:
+        router.probe_task.cancel()
@@ -0,0 +1,47 @@
+import random
+
+import pytest
+
+DIMENSIONS = 64
+THRESHOLD = 0.95
+
+
+def get_vectors(count, seed=0):
+    from rdmo_chatbot.chatbot.caches.semantic import normalize
+
+    rng = random.Random(seed)
+    return [normalize([rng.gauss(0, 1) for _ in range(DIMENSIONS)]) for _ in range(count)]
+
+
+@pytest.fixture
+def partition():
+    from rdmo_chatbot.chatbot.caches.semantic import SemanticPartition
+
+    partition = SemanticPartition()
+    for index, vector in enumerate(get_vectors(100)):
+        partition.add(vector, "history", f"Response {index}", index)
+    return partition
+
+
+def test_similar_question_is_found(partition):
+    for index, vector in enumerate(get_vectors(100)):
+        assert partition.search(vector, "history", THRESHOLD) == f"Response {index}"
+
+
+def test_different_question_is_not_found(partition):
+    for vector in get_vectors(100, seed=1):
+        assert partition.search(vector, "history", THRESHOLD) is None
+
+
+def test_question_after_different_messages_is_not_found(partition):
+    for vector in get_vectors(100):
+        assert partition.search(vector, "other history", THRESHOLD) is None
+
+
+def test_oldest_entries_are_evicted(partition):
+    partition.evict(10)
+
+    vectors = get_vectors(100)
+    assert len(partition) == 90
+    assert partition.search(vectors[0], "history", THRESHOLD) is None
+    assert partition.search(vectors[10], "history", THRESHOLD) == "Response 10"
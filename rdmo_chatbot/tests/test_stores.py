@@ -0,0 +1,154 @@
+import asyncio
+import inspect
+import json
+import time
+
+import pytest
+
+pytestmark = pytest.mark.anyio
+
+# the maximum delay of the event loop (p99) while the sessions use the store
+MAX_LAG = 0.05
+
+SESSIONS = 50
+TURNS = 20
+
+
+async def call(method, *args, **kwargs):
+    result = method(*args, **kwargs)
+    return await result if inspect.isawaitable(result) else result
+
+
+async def monitor_loop(lags, interval=0.005):
+    # the event loop was blocked, if the sleep takes longer than the interval
+    while True:
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        lags.append(time.perf_counter() - started - interval)
+
+
+async def run_session(store, user_identifier, turns):
+    from langchain_core.messages import AIMessage, HumanMessage
+
+    # the history is loaded once, each turn appends two messages,
+    # between the turns, the other sessions can run, like while waiting for the llm
+    await store.get_history(user_identifier, 1)
+    for turn in range(turns):
+        await asyncio.sleep(0)
+        await store.append_messages(user_identifier, 1, [
+            HumanMessage(content=f"Question {turn}"),
+            AIMessage(content=f"Response {turn}")
+        ])
+
+
+@pytest.fixture(params=["locmem", "sqlite3"])
+def store(request, tmp_path, monkeypatch):
+    from rdmo_chatbot.chatbot.stores import AsyncStoreWrapper
+
+    if request.param == "locmem":
+        from rdmo_chatbot.chatbot.stores.locmem import LocMemStore
+        return AsyncStoreWrapper(LocMemStore())
+    else:
+        from rdmo_chatbot.chatbot.stores import sqlite3
+        monkeypatch.setattr(sqlite3.config, "STORE_CONNECTION", str(tmp_path / "test.sqlite3"), raising=False)
+        return AsyncStoreWrapper(sqlite3.Sqlite3Store())
+
+
+@pytest.fixture(params=["sync", "async"])
+def redis_store(request, monkeypatch):
+    fakeredis = pytest.importorskip("fakeredis")
+    pytest.importorskip("lupa")  # fakeredis needs lupa for the lua script of the store
+
+    import redis.asyncio
+
+    from rdmo_chatbot.chatbot.stores import redis as redis_stores
+
+    monkeypatch.setattr(redis_stores.config, "STORE_CONNECTION", {}, raising=False)
+    if request.param == "sync":
+        monkeypatch.setattr(redis, "Redis", fakeredis.FakeRedis)
+        return redis_stores.RedisStore()
+    else:
+        monkeypatch.setattr(redis.asyncio, "Redis", fakeredis.FakeAsyncRedis)
+        return redis_stores.AsyncRedisStore()
+
+
+@pytest.fixture
+def round_trips(monkeypatch):
+    import redis.asyncio.connection
+    import redis.connection
+
+    # every command or pipeline sent to the server is one round-trip
+    round_trips = []
+    send_packed_command = redis.connection.AbstractConnection.send_packed_command
+    async_send_packed_command = redis.asyncio.connection.AbstractConnection.send_packed_command
+
+    def count_send_packed_command(connection, *args, **kwargs):
+        round_trips.append(args)
+        return send_packed_command(connection, *args, **kwargs)
+
+    async def count_async_send_packed_command(connection, *args, **kwargs):
+        round_trips.append(args)
+        return await async_send_packed_command(connection, *args, **kwargs)
+
+    monkeypatch.setattr(redis.connection.AbstractConnection, "send_packed_command", count_send_packed_command)
+    monkeypatch.setattr(redis.asyncio.connection.AbstractConnection, "send_packed_command",
+                        count_async_send_packed_command)
+    return round_trips
+
+
+async def test_store_does_not_block_the_event_loop(store):
+    lags = []
+    monitor = asyncio.create_task(monitor_loop(lags))
+    await asyncio.gather(*[run_session(store, f"test-{index}", TURNS) for index in range(SESSIONS)])
+
+    # the monitor records at least one delay, even if the sessions never waited
+    await asyncio.sleep(0.01)
+    monitor.cancel()
+
+    lags.sort()
+    assert lags[int(len(lags) * 0.99)] <= MAX_LAG
+
+
+@pytest.mark.parametrize("size", [0, 10, 1000])
+async def test_redis_turn_needs_one_round_trip(redis_store, round_trips, size):
+    from langchain_core.messages import AIMessage, HumanMessage
+
+    # the script is loaded into the server once
+    await call(redis_store.append_messages, "warmup", 1, [HumanMessage(content="Hello")])
+
+    history = [AIMessage(content=f"Response {index}") if index % 2 else HumanMessage(content=f"Question {index}")
+               for index in range(size)]
+    await call(redis_store.set_history, "test", 1, history)
+
+    round_trips.clear()
+    await call(redis_store.append_messages, "test", 1, [HumanMessage(content="Hello"), AIMessage(content="Hi")])
+    assert len(round_trips) == 1
+
+
+async def test_redis_migrated_history_expires(redis_store):
+    from langchain_core.messages import AIMessage, HumanMessage
+
+    from rdmo_chatbot.chatbot.utils import messages_to_dicts
+
+    # a history stored by an earlier version is migrated when it is loaded
+    history = [HumanMessage(content="Hello"), AIMessage(content="Hi")]
+    await call(redis_store.redis_client.set, "history:test:1", json.dumps(messages_to_dicts(history)))
+
+    assert [message.content for message in await call(redis_store.get_history, "test", 1)] == ["Hello", "Hi"]
+    assert await call(redis_store.redis_client.ttl, "messages:test:1") > 0
+
+
+def test_redis_store_threads_match_the_pool(monkeypatch):
+    fakeredis = pytest.importorskip("fakeredis")
+
+    import redis
+
+    from rdmo_chatbot.chatbot.stores import AsyncStoreWrapper
+    from rdmo_chatbot.chatbot.stores import redis as redis_stores
+
+    monkeypatch.setattr(redis_stores.config, "STORE_CONNECTION", {"pool_size": 8}, raising=False)
+    monkeypatch.setattr(redis, "Redis", fakeredis.FakeRedis)
+
+    store = redis_stores.RedisStore()
+    assert store.redis_client.connection_pool.max_connections == 8
+    assert AsyncStoreWrapper(store).executor._max_workers == 8